@@ -1,5 +1,31 @@
 import { useState, useEffect, useRef } from 'react';
 
+const textDecoder = new TextDecoder();
+
+/**
+ * Decode a binary frame from the backend (see pack_binary_frame):
+ * [uint32 LE header length][JSON header][float32 LE samples].
+ * Each waveform in the header is [offset, length] into the sample block and
+ * is replaced by a Float32Array view over the frame buffer.
+ * @param {ArrayBuffer} buffer
+ * @returns {Object} message with the same shape as the JSON text frames
+ */
+function decodeBinaryFrame(buffer) {
+  const headerLength = new DataView(buffer).getUint32(0, true);
+  const message = JSON.parse(textDecoder.decode(new Uint8Array(buffer, 4, headerLength)));
+  const samplesStart = 4 + headerLength;
+  const waves = message.data?.data;
+  if (waves) {
+    for (const wave of Object.values(waves)) {
+      if (Array.isArray(wave.waveform)) {
+        const [offset, length] = wave.waveform;
+        wave.waveform = new Float32Array(buffer, samplesStart + offset * 4, length);
+      }
+    }
+  }
+  return message;
+}
+
 /**
  * Custom hook for WebSocket connection management with auto-reconnect
  * @param {Object} options - Configuration options
@@ -35,6 +61,7 @@ export function useWebSocket({ onWavePacket, onPickPacket, onHistoricalData }) {
     const connect = () => {
       console.log('🔌 [useWebSocket] Attempting to connect to WebSocket...');
       wsInstance = new WebSocket(wsUrl);
+      wsInstance.binaryType = 'arraybuffer';
 
       wsInstance.onopen = () => {
         console.log('✅ [useWebSocket] WebSocket Connected');
@@ -63,7 +90,9 @@ export function useWebSocket({ onWavePacket, onPickPacket, onHistoricalData }) {
       };
 
       wsInstance.onmessage = (event) => {
-        const message = JSON.parse(event.data);
+        const message = typeof event.data === 'string'
+          ? JSON.parse(event.data)
+          : decodeBinaryFrame(event.data);
         if (message.event === 'connect_init') {
           console.log('✅ [useWebSocket] Connection initialized');
         } else if (message.event === 'wave_packet') {
@@ -1,9 +1,16 @@
+import heapq
 import time
+from operator import itemgetter
 import redis
 import numpy as np
-import json
 from loguru import logger
 
+try:
+    # orjson decodes pick JSON 3-5x faster; fall back to stdlib if missing
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
+
 class RedisAdapter:
     def __init__(self, host='redis', port=6379, db=0):
         self.host = host
@@ -78,14 +85,16 @@ class RedisAdapter:
         end_id = f"{int(end_time * 1000)}-0"
 
         try:
-            messages = self.redis_client.xrange(stream_key, min=start_id, max=end_id, count=max_picks * 5) # Fetch more to account for updates
+            # Newest first, so a busy stream's COUNT cap drops the oldest picks
+            # rather than the freshest ones (order is restored by the sort below)
+            messages = self.redis_client.xrevrange(stream_key, max=end_id, min=start_id, count=max_picks * 5) # Fetch more to account for updates
             
             best_picks = {} # {station: pick_data}
 
             for _, message in messages:
                 if b'data' in message:
                     try:
-                        pick_data = json.loads(message[b'data'])
+                        pick_data = json_loads(message[b'data'])
                         
                         # Ensure pick_time_float exists
                         if 'pick_time' in pick_data:
@@ -111,16 +120,9 @@ class RedisAdapter:
                     except Exception as e:
                         logger.warning(f"Failed to parse pick data: {e}. Raw message: {message}")
             
-            # Convert to list and sort by pick_time
-            unique_picks = list(best_picks.values())
-            unique_picks.sort(key=lambda x: x['pick_time_float'])
-            
-            # Limit to max_picks (though usually we want all valid stations in the window)
-            # If max_picks is strictly for the number of stations to return:
-            if len(unique_picks) > max_picks:
-                unique_picks = unique_picks[:max_picks]
-                        
-            return unique_picks
+            # Sort by pick_time and keep the earliest max_picks stations in one
+            # pass (same result as sorted(...)[:max_picks])
+            return heapq.nsmallest(max_picks, best_picks.values(), key=itemgetter('pick_time_float'))
 
         except Exception as e:
             logger.error(f"Error fetching picks from Redis: {e}")
@@ -130,7 +132,8 @@ class RedisAdapter:
         """
         Fetch waveform data for multiple stations and channels in parallel using Redis Pipeline.
         Returns (station_headers, data_matrix)
-        - station_headers: list of dicts [{'station': 'A001'}, ...]
+        - station_headers: list of dicts [{'station': 'A001', 'channels': {'HLZ', ...}}, ...]
+          where 'channels' holds the channels that returned data
         - data_matrix: 3D numpy array of shape (N_stations, N_samples, N_channels)
         All arrays are padded/trimmed to exactly int((end_time - start_time) * sampling_rate).
         """
@@ -148,7 +151,9 @@ class RedisAdapter:
             for channel in channels:
                 stream_keys.append(f"wave:{station}:{channel}")
         
-        pipeline = self.redis_client.pipeline()
+        # Plain pipeline (no MULTI/EXEC): the reads are independent, we only
+        # want them batched into a single round-trip.
+        pipeline = self.redis_client.pipeline(transaction=False)
         for key in stream_keys:
             pipeline.xrange(key, min=start_id, max=end_id)
         
@@ -159,6 +164,7 @@ class RedisAdapter:
         n_stations = len(stations)
         n_channels = len(channels)
         data_matrix = np.zeros((n_stations, target_length, n_channels), dtype=np.int32)
+        station_headers = [{'station': s, 'channels': set()} for s in stations]
         
         # Iterate through results and fill matrix
         # results is flat list corresponding to stream_keys
@@ -182,6 +188,7 @@ class RedisAdapter:
                     continue
 
                 full_wave = np.concatenate(waveform_chunks)
+                station_headers[i]['channels'].add(channels[j])
                 current_len = len(full_wave)
                 
                 if current_len == target_length:
@@ -192,7 +199,6 @@ class RedisAdapter:
                     # Pad with zeros at the end
                     data_matrix[i, :current_len, j] = full_wave
         
-        station_headers = [{'station': s} for s in stations]
         return station_headers, data_matrix
 
     def scan_active_stations(self, match_pattern="wave:*:*"):
@@ -235,7 +241,7 @@ class RedisAdapter:
             return
 
         stream_key = f"inference:{model_tag}:results"
-        pipeline = self.redis_client.pipeline()
+        pipeline = self.redis_client.pipeline(transaction=False)
         
         for res in results:
             # Ensure all values are strings or numbers suitable for Redis
@@ -1,3 +1,5 @@
+import queue
+import threading
 import time
 import numpy as np
 import pandas as pd
@@ -10,6 +12,11 @@ from scipy.signal import detrend, iirfilter, sosfilt, zpk2sos
 from scipy.spatial import cKDTree
 import xarray as xr
 
+try:
+    from numba import njit, prange
+except ImportError:  # numba is optional; lowpass falls back to scipy.signal.sosfilt
+    njit = None
+
 # Import from local modules
 from ttsam import get_full_model
 from redis_adapter import RedisAdapter
@@ -33,14 +40,21 @@ TARGET_FILE = "./station/eew_target.csv"
 SAMPLING_RATE = 100
 TARGET_LENGTH = 3000  # 30 seconds @ 100 Hz
 MIN_DURATION = 30.0
+MAX_STATIONS = 25  # TTSAM input station slots
+DEFAULT_CONSTANT = 3.2e-6  # default count-to-acceleration constant for unknown station/channel
 
 # ============ Global Variables ============
 tree = None
 vs30_table = None
 site_info = None
 constant_dict = {}
+constant_arr = None  # (N_stations, N_channels) constants, rows follow site_info
+station_row_idx = {}  # station code -> row in site_info / constant_arr
 target_dict = None
+target_matrix = None  # (N_targets, 4): latitude, longitude, elevation, Vs30
+target_names = []
 model = None
+pinned_inputs = {}  # name -> reusable page-locked staging tensor (CUDA only)
 
 # ============ Helper Functions ============
 
@@ -56,6 +70,10 @@ def load_vs30():
 
         vs30_table = pd.DataFrame({"lat": lat_flat, "lon": lon_flat, "Vs30": vs30_flat})
         vs30_table = vs30_table.replace([np.inf, -np.inf], np.nan).dropna()
+        # Reorder the grid into KD-tree leaf order and rebuild the tree, so
+        # spatially close points are also close in memory during queries.
+        perm = cKDTree(vs30_table[["lat", "lon"]]).indices
+        vs30_table = vs30_table.iloc[perm].reset_index(drop=True)
         tree = cKDTree(vs30_table[["lat", "lon"]])
         logger.info("Vs30 data loaded successfully.")
     except Exception as e:
@@ -70,7 +88,7 @@ def get_vs30(lat, lon, user_vs30=600):
     return float(vs30)
 
 def load_station_info():
-    global site_info, constant_dict
+    global site_info, constant_dict, constant_arr, station_row_idx
     try:
         logger.info(f"Loading {SITE_INFO_FILE}...")
         df = pd.read_csv(SITE_INFO_FILE)
@@ -84,16 +102,33 @@ def load_station_info():
             constant_dict = {}
             
         site_info = df.drop_duplicates(subset=["Station"]).reset_index(drop=True)
+
+        # Dense lookup table so scaling is one fancy-indexed multiply per station
+        station_row_idx = {sta: i for i, sta in enumerate(site_info["Station"])}
+        constant_arr = np.full((len(site_info), len(ALL_CHANNELS)), DEFAULT_CONSTANT)
+        for (sta, ch), const in constant_dict.items():
+            if ch in CHANNEL_TO_IDX:
+                constant_arr[station_row_idx[sta], CHANNEL_TO_IDX[ch]] = const
         logger.info(f"Loaded {len(site_info)} stations and {len(constant_dict)} constants.")
     except Exception as e:
         logger.error(f"Failed to load site info: {e}")
 
 def load_target_info():
-    global target_dict
+    global target_dict, target_matrix, target_names
     try:
         logger.info(f"Loading {TARGET_FILE}...")
         target_df = pd.read_csv(TARGET_FILE)
         target_dict = target_df.to_dict(orient="records")
+
+        # Targets are static: build the model input once, with one batched Vs30 query
+        coords = target_df[["latitude", "longitude", "elevation"]].to_numpy(dtype=np.float64)
+        if tree is not None and vs30_table is not None:
+            _, idx = tree.query(coords[:, :2])
+            vs30 = vs30_table["Vs30"].to_numpy(dtype=np.float64)[idx]
+        else:
+            vs30 = np.full(len(coords), 600.0)
+        target_matrix = np.column_stack([coords, vs30])
+        target_names = target_df["station"].tolist()
         logger.info(f"Loaded {len(target_dict)} targets.")
     except Exception as e:
         logger.error(f"Failed to load target info: {e}")
@@ -109,6 +144,31 @@ def load_model():
     except Exception as e:
         logger.error(f"Failed to load model: {e}")
 
+if njit is not None:
+    @njit(cache=True, parallel=True)
+    def _sosfilt_rows(sos, x):
+        """
+        Cascaded biquad filter (direct form II transposed, as scipy.sosfilt)
+        along the last axis of a 2D array, one independent trace per row.
+        All sections are applied per sample, so no intermediate array is built.
+        """
+        n_rows, n_samples = x.shape
+        n_sections = sos.shape[0]
+        out = np.empty_like(x)
+        for r in prange(n_rows):
+            zi = np.zeros((n_sections, 2))
+            for t in range(n_samples):
+                y = x[r, t]
+                for s in range(n_sections):
+                    y_out = sos[s, 0] * y + zi[s, 0]
+                    zi[s, 0] = sos[s, 1] * y - sos[s, 4] * y_out + zi[s, 1]
+                    zi[s, 1] = sos[s, 2] * y - sos[s, 5] * y_out
+                    y = y_out
+                out[r, t] = y
+        return out
+else:
+    _sosfilt_rows = None
+
 def lowpass(data, freq=10, df=100, corners=4, axis=0):
     fe = 0.5 * df
     f = freq / fe
@@ -116,7 +176,17 @@ def lowpass(data, freq=10, df=100, corners=4, axis=0):
         f = 1.0
     z, p, k = iirfilter(corners, f, btype="lowpass", ftype="butter", output="zpk")
     sos = zpk2sos(z, p, k)
-    return sosfilt(sos, data, axis=axis)
+
+    # Lay every trace along `axis` out as one C-contiguous row, so both filter
+    # paths walk memory sequentially instead of striding across channels
+    rows = np.moveaxis(data, axis, -1)
+    shape = rows.shape
+    rows = np.ascontiguousarray(rows, dtype=np.float64).reshape(-1, shape[-1])
+    if _sosfilt_rows is None:
+        filtered = sosfilt(sos, rows, axis=-1)
+    else:
+        filtered = _sosfilt_rows(sos, rows)
+    return np.moveaxis(filtered.reshape(shape), -1, axis)
 
 def signal_processing(waveform, axis=0):
     data = detrend(waveform, axis=axis, type="constant")
@@ -145,17 +215,20 @@ CHANNEL_MAP = {
     'E': ['HLE', 'EHE', 'E', '2']
 }
 ALL_CHANNELS = list(set([ch for sublist in CHANNEL_MAP.values() for ch in sublist]))
+CHANNEL_TO_IDX = {ch: i for i, ch in enumerate(ALL_CHANNELS)}
 
 def fetch_and_process_waveforms_from_picks(redis_adapter, picks, duration=30):
     """
     Fetch waveforms based on provided picks using bulk fetch.
     Selects top 25 unique stations from the sorted picks.
+    Returns (waveform_padded, station_info_padded, valid_stations): the first
+    two are zero-padded (MAX_STATIONS, ...) model inputs, filled in place.
     """
     # Picks are already unique and sorted from adapter
-    selected_picks = picks[:25]
+    selected_picks = picks[:MAX_STATIONS]
     
     if not selected_picks:
-        return [], [], []
+        return None, None, []
         
     logger.info(f"Selected {len(selected_picks)} stations from picks.")
 
@@ -179,11 +252,11 @@ def fetch_and_process_waveforms_from_picks(redis_adapter, picks, duration=30):
     )
     
     # Mappings
-    channel_to_idx = {ch: i for i, ch in enumerate(ALL_CHANNELS)}
     station_to_idx = {h['station']: i for i, h in enumerate(headers)}
 
-    waveforms = []
-    station_info_list = []
+    # One allocation per cycle: every station is written straight into its slot
+    waveform_padded = np.zeros((MAX_STATIONS, TARGET_LENGTH, 3))
+    station_info_padded = np.zeros((MAX_STATIONS, 4))
     valid_stations = []
 
     # 4. Process each station
@@ -196,6 +269,7 @@ def fetch_and_process_waveforms_from_picks(redis_adapter, picks, duration=30):
             
         idx = station_to_idx[station_code]
         station_data = data_matrix[idx] # (Time, N_channels)
+        present_channels = headers[idx]['channels']
         
         # Calculate offset
         time_offset_seconds = pick_time - fetch_start_time
@@ -211,73 +285,43 @@ def fetch_and_process_waveforms_from_picks(redis_adapter, picks, duration=30):
             
         window_data = station_data[s_start:s_end, :]
         
-        # Pad locally if needed
-        current_len = window_data.shape[0]
-        if current_len < TARGET_LENGTH:
-            padded = np.zeros((TARGET_LENGTH, len(ALL_CHANNELS)), dtype=np.int32)
-            dest_start = max(0, -start_sample)
-            dest_end = dest_start + current_len
-            if dest_end <= TARGET_LENGTH:
-                padded[dest_start:dest_end, :] = window_data
-                window_data = padded
-            else:
-                continue
-        elif current_len > TARGET_LENGTH:
-             window_data = window_data[:TARGET_LENGTH, :]
+        # Destination range inside the zero-padded TARGET_LENGTH slot
+        current_len = min(window_data.shape[0], TARGET_LENGTH)
+        dest_start = max(0, -start_sample)
+        dest_end = dest_start + current_len
+        if dest_end > TARGET_LENGTH:
+            continue
 
         # Select best channels
-        def get_channel_data(priority_list):
+        def get_channel_idx(priority_list):
             for ch in priority_list:
-                if ch in channel_to_idx:
-                    ch_idx = channel_to_idx[ch]
-                    trace = window_data[:, ch_idx]
-                    if np.any(trace != 0):
-                        return trace, ch
-            return None, None
-
-        z_data, z_ch = get_channel_data(CHANNEL_MAP['Z'])
-        n_data, n_ch = get_channel_data(CHANNEL_MAP['N'])
-        e_data, e_ch = get_channel_data(CHANNEL_MAP['E'])
-
-        if z_data is None:
-            continue
-            
-        # Fallback for missing components
-        if n_data is None: 
-            n_data = z_data.copy()
-            n_ch = z_ch # Use Z constant if N is missing/copied? Or default? 
-                        # If we copy Z data, we probably should use Z constant or just treat it as is.
-                        # But strictly speaking, if we use Z data for N, it's already scaled by Z constant if we scale before copy.
-                        # Let's scale AFTER copy to be safe, but wait, if we copy raw counts, we need N constant.
-                        # If N is missing, we don't have N constant. 
-                        # Let's assume if missing, we use default constant for the "virtual" channel or just Z's constant?
-                        # Using Z's constant seems safer if we are copying Z's data.
-        
-        if e_data is None: 
-            e_data = z_data.copy()
-            e_ch = z_ch
-
-        # Apply constants
-        def apply_constant(data, station, channel):
-            if channel is None:
-                return data * 3.2e-6
-            const = constant_dict.get((station, channel), 3.2e-6)
-            return data * const
-
-        z_data = apply_constant(z_data, station_code, z_ch)
-        n_data = apply_constant(n_data, station_code, n_ch)
-        e_data = apply_constant(e_data, station_code, e_ch)
-
-        # Stack and Process
-        waveform_3c = np.stack([z_data, n_data, e_data], axis=1) # (3000, 3)
-        
-        try:
-            waveform_3c = signal_processing(waveform_3c, axis=0)
-        except Exception as e:
-            logger.warning(f"Signal processing failed for {station_code}: {e}")
-            continue
+                # Presence comes from the bulk fetch, no need to scan the trace
+                if ch in present_channels:
+                    return CHANNEL_TO_IDX[ch]
+            return None
 
-        waveforms.append(waveform_3c)
+        z_idx = get_channel_idx(CHANNEL_MAP['Z'])
+        if z_idx is None:
+            continue
+        n_idx = get_channel_idx(CHANNEL_MAP['N'])
+        e_idx = get_channel_idx(CHANNEL_MAP['E'])
+
+        # Missing horizontal components fall back to the Z trace and Z constant
+        if n_idx is None:
+            n_idx = z_idx
+        if e_idx is None:
+            e_idx = z_idx
+
+        # Select, scale and pad Z/N/E straight into this station's slot
+        slot = len(valid_stations)
+        columns = [z_idx, n_idx, e_idx]
+        row = station_row_idx.get(station_code)
+        scales = constant_arr[row, columns] if row is not None else DEFAULT_CONSTANT
+        np.multiply(
+            window_data[:current_len, columns],
+            scales,
+            out=waveform_padded[slot, dest_start:dest_end],
+        )
         
         # Metadata
         station_row = site_info[site_info['Station'] == station_code]
@@ -289,7 +333,7 @@ def fetch_and_process_waveforms_from_picks(redis_adapter, picks, duration=30):
             lat, lon, elev = 0, 0, 0
 
         vs30 = get_vs30(lat, lon)
-        station_info_list.append([lat, lon, elev, vs30])
+        station_info_padded[slot] = (lat, lon, elev, vs30)
         valid_stations.append({
             "Station": station_code,
             "Latitude": lat,
@@ -298,7 +342,18 @@ def fetch_and_process_waveforms_from_picks(redis_adapter, picks, duration=30):
             "PickTime": pick_time
         })
 
-    return waveforms, station_info_list, valid_stations
+    # Filter all selected stations in one call: (N_stations, 3000, 3) along time
+    num_stations = len(valid_stations)
+    if num_stations:
+        try:
+            waveform_padded[:num_stations] = signal_processing(
+                waveform_padded[:num_stations], axis=1
+            )
+        except Exception as e:
+            logger.warning(f"Signal processing failed: {e}")
+            return None, None, []
+
+    return waveform_padded, station_info_padded, valid_stations
 
 def calculate_intensity(pga):
     """
@@ -338,66 +393,49 @@ def intensity_to_rank(intensity):
     }
     return intensity_map.get(intensity, 0)
 
-def run_inference(waveforms, station_info_list, redis_adapter=None):
-    if not waveforms:
+def to_model_device(name, array, device):
+    """
+    Turn a NumPy input into a (1, ...) float64 tensor on the model device.
+    On CUDA the data goes through a reused pinned buffer so the host-to-device
+    copy can be issued with non_blocking=True.
+    """
+    src = torch.from_numpy(np.ascontiguousarray(array)).unsqueeze(0).double()
+    if device.type != "cuda":
+        return src.to(device)
+
+    buf = pinned_inputs.get(name)
+    if buf is None or buf.shape != src.shape:
+        buf = torch.empty(src.shape, dtype=torch.float64, pin_memory=True)
+        pinned_inputs[name] = buf
+    buf.copy_(src)
+    return buf.to(device, non_blocking=True)
+
+def run_inference(waveform_padded, station_info_padded, num_stations, redis_adapter=None):
+    """
+    waveform_padded / station_info_padded are the zero-padded
+    (MAX_STATIONS, ...) arrays from fetch_and_process_waveforms_from_picks.
+    """
+    if not num_stations:
         logger.warning("No waveforms to process.")
         return
 
-    # Padding to 25 stations
-    max_stations = 25
-    waveform_padded = np.zeros((max_stations, 3000, 3))
-    station_info_padded = np.zeros((max_stations, 4))
+    # All targets in one pass: targets only attend to stations inside the
+    # model, so a single forward pass replaces the former 25-target batches.
+    logger.info(f"Running inference for {num_stations} stations and {len(target_names)} targets...")
 
-    num_stations = min(len(waveforms), max_stations)
-    for i in range(num_stations):
-        waveform_padded[i] = waveforms[i]
-        station_info_padded[i] = station_info_list[i]
+    device = next(model.parameters()).device
+    tensor_data = {
+        "waveform": to_model_device("waveform", waveform_padded, device),
+        "station": to_model_device("station", station_info_padded, device),
+        "target": to_model_device("target", target_matrix, device),
+    }
 
-    # Prepare targets (batch processing)
-    batch_size = 25
-    total_targets = len(target_dict)
-    num_batches = (total_targets + batch_size - 1) // batch_size
-    
-    all_pga_list = []
-    all_target_names = []
-
-    logger.info(f"Running inference for {num_stations} stations...")
-
-    for batch_idx in range(num_batches):
-        start_idx = batch_idx * batch_size
-        end_idx = min((batch_idx + 1) * batch_size, total_targets)
-        batch_targets = target_dict[start_idx:end_idx]
-
-        target_list = []
-        target_names = []
-        for target in batch_targets:
-            target_list.append([
-                target["latitude"],
-                target["longitude"],
-                target["elevation"],
-                get_vs30(target["latitude"], target["longitude"])
-            ])
-            target_names.append(target["station"])
-
-        target_padded = np.zeros((batch_size, 4))
-        for i in range(len(target_list)):
-            target_padded[i] = target_list[i]
-
-        tensor_data = {
-            "waveform": torch.tensor(waveform_padded).unsqueeze(0).double().to(next(model.parameters()).device),
-            "station": torch.tensor(station_info_padded).unsqueeze(0).double().to(next(model.parameters()).device),
-            "target": torch.tensor(target_padded).unsqueeze(0).double().to(next(model.parameters()).device),
-        }
-
-        with torch.no_grad():
-            weight, sigma, mu = model(tensor_data)
-            batch_pga = torch.sum(weight * mu, dim=2).cpu().detach().numpy().flatten().tolist()
-
-        all_pga_list.extend(batch_pga[:len(target_names)])
-        all_target_names.extend(target_names)
+    with torch.no_grad():
+        weight, sigma, mu = model(tensor_data)
+        all_pga_list = torch.sum(weight * mu, dim=2).cpu().detach().numpy().flatten().tolist()
 
     # Output results sorted by intensity (highest to lowest)
-    results = list(zip(all_target_names, all_pga_list))
+    results = list(zip(target_names, all_pga_list))
     # Add intensity to each result for sorting
     results_with_intensity = [(name, pga, calculate_intensity(pga)) for name, pga in results]
     # Sort by intensity rank (highest first), then by PGA within same intensity
@@ -424,6 +462,39 @@ def run_inference(waveforms, station_info_list, redis_adapter=None):
         redis_adapter.publish_inference_results("ttsam", publish_data)
         logger.info(f"Published {len(publish_data)} results to Redis.")
 
+def prefetch_worker(redis_adapter, batch_queue, stop_event, lookback=10, poll_interval=1):
+    """
+    Producer stage: poll picks, fetch and preprocess waveforms, and hand the
+    result to the inference loop. Runs in its own thread so Redis I/O and
+    signal processing overlap with model inference.
+    """
+    while not stop_event.is_set():
+        try:
+            picks = get_recent_picks(redis_adapter, lookback_seconds=lookback)
+
+            if len(picks) >= 5:
+                logger.info(f"Found {len(picks)} picks.")
+                waveform_padded, station_info_padded, valid_stations = fetch_and_process_waveforms_from_picks(
+                    redis_adapter, picks, duration=30
+                )
+
+                if valid_stations:
+                    # Keep only the freshest batches: drop the oldest if inference lags
+                    if batch_queue.full():
+                        try:
+                            batch_queue.get_nowait()
+                        except queue.Empty:
+                            pass
+                    batch_queue.put((waveform_padded, station_info_padded, len(valid_stations)))
+                else:
+                    logger.warning("No waveforms could be extracted from the picks.")
+            else:
+                logger.info(f"{len(picks)} picks found in the last {lookback} seconds.")
+        except Exception as e:
+            logger.error(f"Error in prefetch worker: {e}")
+
+        stop_event.wait(poll_interval)
+
 def main():
     # Initialize
     load_vs30()
@@ -437,32 +508,31 @@ def main():
         return
 
     logger.info("Starting Redis Inference Demo (Pick-Triggered)...")
-    
+
+    # Fetch/preprocess in a background thread, run inference here
+    batch_queue = queue.Queue(maxsize=2)
+    stop_event = threading.Event()
+    fetcher = threading.Thread(
+        target=prefetch_worker,
+        args=(redis_adapter, batch_queue, stop_event),
+        daemon=True,
+    )
+    fetcher.start()
+
     try:
         while True:
-            # Loop to simulate real-time
-            lookback = 10 # seconds
-            # logger.info(f"Fetching picks from last {lookback} seconds...")
-            
-            picks = get_recent_picks(redis_adapter, lookback_seconds=lookback)
-            
-            if len(picks) >= 5:
-                logger.info(f"Found {len(picks)} picks.")
-                waveforms, station_info_list, _ = fetch_and_process_waveforms_from_picks(
-                    redis_adapter, picks, duration=30
-                )
-                
-                if waveforms:
-                    run_inference(waveforms, station_info_list, redis_adapter=redis_adapter)
-                else:
-                    logger.warning("No waveforms could be extracted from the picks.")
-            else:
-                logger.info(f"{len(picks)} picks found in the last 10 seconds.")
+            try:
+                waveform_padded, station_info_padded, num_stations = batch_queue.get(timeout=1)
+            except queue.Empty:
+                continue
 
-            time.sleep(1)
+            run_inference(waveform_padded, station_info_padded, num_stations, redis_adapter=redis_adapter)
 
     except KeyboardInterrupt:
         logger.info("Stopping inference demo.")
+    finally:
+        stop_event.set()
+        fetcher.join(timeout=5)
 
 if __name__ == "__main__":
     main()
@@ -309,6 +309,9 @@ class FullModel(nn.Module):
         self.emb_dim = emb_dim
 
     def forward(self, data):
+        # 目標點彼此在 pad_mask 中皆被遮蔽，僅對測站做 attention，
+        # 因此目標數量可依輸入而變，一次前向傳遞即可涵蓋所有目標
+        pga_targets = data["target"].shape[1]
         cnn_output = self.model_CNN(
             torch.DoubleTensor(data["waveform"].reshape(-1, self.data_length, 3))
             .float()
@@ -334,7 +337,7 @@ class FullModel(nn.Module):
             .to(device)
         )
         pga_pos_emb_output = pga_pos_emb_output.reshape(
-            -1, self.pga_targets, self.emb_dim
+            -1, pga_targets, self.emb_dim
         )
 
         target_pad_mask = torch.ones_like(data["target"], dtype=torch.bool)
@@ -345,7 +348,7 @@ class FullModel(nn.Module):
         transformer_input = torch.cat((add_pe_cnn_output, pga_pos_emb_output), dim=1)
         transformer_output = self.model_Transformer(transformer_input, pad_mask)
 
-        mlp_input = transformer_output[:, -self.pga_targets :, :].to(device)
+        mlp_input = transformer_output[:, -pga_targets:, :].to(device)
         mlp_output = self.model_mlp(mlp_input)
         weight, sigma, mu = self.model_MDN(mlp_output)
 
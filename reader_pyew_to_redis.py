@@ -4,9 +4,11 @@ Example: read wave / pick / eew messages from Earthworm rings using PyEW,
 print metadata / message contents (no Redis). Does NOT modify PyEW.
 
 Behavior:
-- Uses EWModule.get_wave(...) for wave messages (message type 19).
-- Uses transport.copymsg_type(msg_type) for other message categories (pick, eew).
+- Uses transport.copymsg_type(msg_type) for all message categories; wave messages
+  (type 19) are decoded directly from the raw TRACEBUF2 bytes with struct.
 - Runs one subprocess per (ring, category) to avoid GIL limits and allow parallel reads.
+  With --threads, runs one thread per ring inside a single process instead
+  (lower memory / startup cost, one shared Redis connection pool).
 - Prints parsed metadata or decoded text for each received message.
 
 Usage:
@@ -16,20 +18,28 @@ Usage:
 
 Notes:
 - You MUST supply correct Earthworm message type integers for non-wave categories
-  in MSG_TYPE_MAP (pick/eew). Wave messages are typically type 19 and are handled
-  by EWModule.get_wave to reuse PyEW's parsing.
+  in MSG_TYPE_MAP (pick/eew). Wave messages are typically type 19 and are parsed
+  by parse_tracebuf2 (header fields + samples as little-endian int32 bytes).
 - If you don't know the message type for a category, put None in MSG_TYPE_MAP;
   the worker will still fetch raw bytes but will attempt to decode as text.
 """
 import time
 import argparse
 import multiprocessing as mp
+import struct
 import sys
 import os
+import threading
 from pprint import pprint
 from datetime import datetime
+import numpy as np
 import redis
-import json
+
+try:
+    # orjson serializes straight to bytes, several times faster than stdlib json
+    from orjson import dumps as json_dumps
+except ImportError:
+    from json import dumps as json_dumps
 
 # ---- Configuration: edit for your environment ----
 earthworm_param = {
@@ -74,14 +84,66 @@ redis_config = {
     "port": 6379,
     "db": 0,
 }
+# REDIS_URL overrides REDIS_HOST, e.g. unix:///var/run/redis/redis.sock when
+# Redis runs on the same host (skips the TCP stack).
+if os.getenv("REDIS_URL"):
+    redis_config = {"url": os.getenv("REDIS_URL")}
+
+# Wave XADDs are pipelined: flush after this many messages, once the oldest
+# queued one has waited this many seconds, or as soon as the ring runs dry,
+# whichever comes first.
+WAVE_PIPELINE_SIZE = 64
+WAVE_PIPELINE_MAX_DELAY = 0.05
+# Every WAVE_TRIM_INTERVAL seconds, each wave stream written since the last
+# trim gets one XTRIM MINID dropping entries older than WAVE_STREAM_SECONDS.
+WAVE_TRIM_INTERVAL = 5.0
+WAVE_STREAM_SECONDS = 120
+# Redis SET of every wave stream key, so consumers can discover streams with
+# SMEMBERS instead of SCANning the keyspace
+WAVE_STREAM_REGISTRY = "wave_streams"
+
+# Idle polling backs off exponentially from this sleep up to --delay, so a
+# quiet ring costs few wakeups while the first packet after a burst is picked
+# up quickly.
+IDLE_SLEEP_MIN = 0.0001
+
+# Set by main() to stop workers running as threads (--threads); worker
+# processes are stopped with terminate() and never see it set.
+stop_event = threading.Event()
 # -------------------------------------------------
 
+# TRACE2_HEADER (Earthworm trace_buf.h), 64 bytes:
+# pinno, nsamp, starttime, endtime, samprate, sta[7], net[9], chan[4], loc[3],
+# version[2], datatype[3], quality[2], pad[2]
+# Byte order of the header and samples follows datatype ('i'/'f' Intel, 's'/'t' Sparc).
+TRACE2_HEADER_LE = struct.Struct("<iiddd7s9s4s3s2s3s2s2x")
+TRACE2_HEADER_BE = struct.Struct(">iiddd7s9s4s3s2s3s2s2x")
+TRACE2_DATATYPE_OFFSET = 57
+# nsamp, starttime, endtime: the only header fields that change from packet to
+# packet of one channel. samprate..datatype (bytes 24-60) are invariant per SCNL.
+TRACE2_VARYING_LE = struct.Struct("<4xidd")
+TRACE2_VARYING_BE = struct.Struct(">4xidd")
+TRACE2_INVARIANT_SLICE = slice(24, 60)
+# datatype -> np.dtype, built once so the per-packet path is a dict lookup
+# and dtype checks are identity compares.
+TRACE2_SAMPLE_DTYPES = {
+    dt: np.dtype(npdt) for dt, npdt in {
+        "i2": "<i2", "i4": "<i4", "i8": "<i8", "f4": "<f4", "f8": "<f8",
+        "s2": ">i2", "s4": ">i4", "s8": ">i8", "t4": ">f4", "t8": ">f8",
+    }.items()
+}
+# Samples are stored in Redis as little-endian int32; wider or float samples
+# are rounded and saturated to this range
+TRACE2_STORED_DTYPE = TRACE2_SAMPLE_DTYPES["i4"]
+TRACE2_STORED_MIN = np.iinfo(TRACE2_STORED_DTYPE).min
+TRACE2_STORED_MAX = np.iinfo(TRACE2_STORED_DTYPE).max
+
 # Import PyEW classes (must be installed/importable)
-from PyEW import EWModule, transport
+from PyEW import transport
 
 
 def pretty_print_wave(result):
-    """Print metadata + short data summary from EWModule.get_wave() result dict."""
+    """Print metadata + short data summary from a wave dict (see parse_tracebuf2)."""
     meta_keys = ['station', 'network', 'channel', 'location',
                  'nsamp', 'samprate', 'startt', 'endt', 'datatype']
     meta = {k: result.get(k) for k in meta_keys}
@@ -100,9 +162,9 @@ def pretty_print_wave(result):
 
 
 def parse_text_message(b):
-    """Try to decode a text message, fallback to hex summary."""
+    """Try to decode a text message (any bytes-like object), fallback to hex summary."""
     try:
-        text = b.decode('utf-8')
+        text = str(b, 'utf-8')
         # Trim to reasonable length for printing
         if len(text) > 1000:
             text = text[:1000] + '... (truncated)'
@@ -112,9 +174,112 @@ def parse_text_message(b):
         return ("binary", f"len={len(b)} hex-prefix={b[:64].hex()}...")
 
 
+def _c_string(raw):
+    """NUL-terminated C char array -> str."""
+    return raw.split(b"\0", 1)[0].decode("ascii", errors="replace")
+
+
+# Raw header bytes 24-60 -> (decoded invariant fields, varying-field struct,
+# sample dtype, sample size, Redis stream key). The SCNL set of a ring is
+# fixed, so this stays small.
+_trace2_templates = {}
+
+
+def _trace2_template(msg):
+    """Decode and cache the per-SCNL part of a TRACEBUF2 header (None if unknown datatype)."""
+    key = bytes(msg[TRACE2_INVARIANT_SLICE])
+    tmpl = _trace2_templates.get(key)
+    if tmpl is None:
+        datatype = _c_string(bytes(msg[TRACE2_DATATYPE_OFFSET:TRACE2_DATATYPE_OFFSET + 3]))
+        sample_dtype = TRACE2_SAMPLE_DTYPES.get(datatype)
+        if sample_dtype is None:
+            return None
+        big_endian = datatype[0] in "st"
+        header = TRACE2_HEADER_BE if big_endian else TRACE2_HEADER_LE
+        (_, _, _, _, samprate,
+         sta, net, chan, loc, _, _, _) = header.unpack_from(msg)
+        fields = {
+            "station": _c_string(sta),
+            "network": _c_string(net),
+            "channel": _c_string(chan),
+            "location": _c_string(loc),
+            "samprate": samprate,
+            "datatype": "i4",  # 'data' is always stored as little-endian int32
+        }
+        varying = TRACE2_VARYING_BE if big_endian else TRACE2_VARYING_LE
+        stream_key = None
+        if fields["station"] and fields["channel"]:
+            stream_key = f"wave:{fields['station']}:{fields['channel']}".encode()
+        tmpl = (fields, varying, sample_dtype, sample_dtype.itemsize, stream_key)
+        _trace2_templates[key] = tmpl
+    return tmpl
+
+
+def parse_tracebuf2(msg):
+    """
+    Decode a raw TRACEBUF2 message (bytes-like) into the same fields
+    EWModule.get_wave returns. 'data' holds the samples as little-endian int32
+    bytes, the layout the backend reads. Returns None for malformed messages.
+    """
+    decoded = decode_tracebuf2(msg)
+    return decoded[1] if decoded is not None else None
+
+
+def decode_tracebuf2(msg):
+    """
+    parse_tracebuf2, also returning the cached 'wave:{station}:{channel}'
+    stream key (None if station or channel is blank): (stream_key, res).
+    The per-SCNL header fields are decoded once and reused (_trace2_template).
+    """
+    if len(msg) < TRACE2_HEADER_LE.size:
+        return None
+
+    tmpl = _trace2_template(msg)
+    if tmpl is None:
+        return None
+    fields, varying, sample_dtype, sample_size, stream_key = tmpl
+
+    nsamp, startt, endt = varying.unpack_from(msg)
+    if nsamp <= 0 or len(msg) < TRACE2_HEADER_LE.size + nsamp * sample_size:
+        return None
+
+    res = fields.copy()
+    res["nsamp"] = nsamp
+    res["startt"] = startt
+    res["endt"] = endt
+    if sample_dtype is TRACE2_STORED_DTYPE:
+        # Already the stored layout: one copy out of the ring buffer. (A bare
+        # memoryview would be zero-copy, but the buffer must outlive the
+        # pipelined XADD.)
+        res["data"] = bytes(msg[TRACE2_HEADER_LE.size:TRACE2_HEADER_LE.size + 4 * nsamp])
+    else:
+        # Convert straight into the output buffer: one pass, no astype() temp
+        # array followed by a tobytes() copy
+        samples = np.frombuffer(msg, dtype=sample_dtype, count=nsamp, offset=TRACE2_HEADER_LE.size)
+        out = bytearray(4 * nsamp)
+        stored = np.frombuffer(out, dtype=TRACE2_STORED_DTYPE)
+        if sample_dtype.kind == "f":
+            # f4/f8/t4/t8: round to the nearest count (NaN -> 0) and saturate
+            # instead of the cast's truncation toward zero. Clipped in float64,
+            # where int32's max is exact (float32 would round it up to 2**31).
+            rounded = np.nan_to_num(np.rint(samples, dtype=np.float64), copy=False)
+            stored[:] = np.clip(rounded, TRACE2_STORED_MIN, TRACE2_STORED_MAX, out=rounded)
+        elif sample_dtype.itemsize > TRACE2_STORED_DTYPE.itemsize:
+            # i8/s8: saturate instead of wrapping around
+            np.clip(samples, TRACE2_STORED_MIN, TRACE2_STORED_MAX, out=stored, casting="unsafe")
+        else:
+            stored[:] = samples  # i2/s2/s4 fit exactly
+        res["data"] = memoryview(out)  # redis-py takes bytes or memoryview, not bytearray
+    return stream_key, res
+
+
+ID_CODE = {"N": "network", "S": "station", "L": "location", "C": "channel"}
+
+
 def join_id_from_dict(data, order="NSLC"):
-    code = {"N": "network", "S": "station", "L": "location", "C": "channel"}
-    data_id = ".".join(data[code[letter]] for letter in order)
+    if order == "NSLC":
+        return f'{data["network"]}.{data["station"]}.{data["location"]}.{data["channel"]}'
+    data_id = ".".join(data[ID_CODE[letter]] for letter in order)
     return data_id
 
 
@@ -147,85 +312,113 @@ def parse_pick_msg(pick_msg):
         return None
 
 
-def worker_wave(rname, ringid, modid, instid, poll_delay, redis_cfg):
+def worker_wave(rname, ringid, modid, instid, msg_type, poll_delay, redis_cfg):
     """
-    Worker that uses EWModule to add a ring and call get_wave (which does the Trace parsing).
-    We create a short-lived EWModule for each worker and call add_ring + get_wave.
+    Worker that copies raw TRACEBUF2 messages from a ring with transport.copymsg_type
+    and decodes them with parse_tracebuf2 (struct header + sample bytes, no
+    per-message dict/array construction inside PyEW).
     This worker also writes the received wave data to a Redis Stream.
     """
     print(f"[wave worker] {rname}={ringid} starting")
     try:
-        redis_client = redis.Redis(**redis_cfg)
+        redis_client = connect_redis(redis_cfg)
         redis_client.ping()
         print(f"[wave worker] {rname}={ringid} connected to Redis.")
     except Exception as e:
         print(f"[wave worker] {rname}={ringid} could not connect to Redis: {e}", file=sys.stderr)
         return
 
-    # hb_time arbitrary (heartbeat thread will run); debug False
-    module = EWModule(def_ring=1000, mod_id=modid, inst_id=instid, hb_time=15, db=False)
-    module.add_ring(ringid)
-    buf_index = len(module.ringcom) - 1
+    t = transport(ringid, modid, instid)
+    t.flush()
+    copymsg_type = t.copymsg_type  # bind once, keep attribute lookups off the hot loop
+    idle_min = min(IDLE_SLEEP_MIN, poll_delay)
+    idle_sleep = idle_min
     
     wave_count = 0
     batch_count = 0
-    skip_trim_counter = 0  # Only trim every N writes to reduce overhead
+    touched_keys = set()  # streams written since the last trim
+    registered_keys = set()  # streams this worker has added to WAVE_STREAM_REGISTRY
+    registering_keys = set()  # SADDs queued on the pipeline, not yet executed
+    trim_deadline = time.monotonic() + WAVE_TRIM_INTERVAL
+
+    # One round-trip per batch of waves instead of one per wave
+    pipe = redis_client.pipeline(transaction=False)
+    pending = 0
+    flush_deadline = 0.0  # set when the first wave of a batch is queued
+
+    def flush():
+        nonlocal pending, batch_count
+        if pending:
+            try:
+                pipe.execute()
+                batch_count += pending
+                # Only count a stream as registered once its SADD went through;
+                # a failed batch re-queues the SADD with the stream's next wave
+                registered_keys.update(registering_keys)
+            except Exception as e:
+                print(f"[wave worker] {rname}={ringid} redis write failed: {e}", file=sys.stderr)
+            registering_keys.clear()
+            pending = 0
     
     try:
-        while True:
-            res = module.get_wave(buf_index)
-            if res:
+        while not stop_event.is_set():
+            msg = copymsg_type(msg_type)
+            if msg != (0, 0):
+                idle_sleep = idle_min
+                status, rlen, realmsg = msg
+                if rlen <= 0:
+                    continue
+                decoded = decode_tracebuf2(memoryview(realmsg)[:rlen])
+                if decoded is None:
+                    continue
+
                 wave_count += 1
-                station = res.get('station')
-                channel = res.get('channel')
+                stream_key, res = decoded
                 
-                if station and channel:
-                    stream_key = f"wave:{station}:{channel}"
-                    
-                    # Prepare data for Redis Stream. NumPy array must be converted to bytes.
-                    message_payload = {k: v for k, v in res.items() if k != 'data'}
-                    if 'data' in res and res['data'] is not None:
-                        message_payload['data'] = res['data'].tobytes()
-
-                    # Add to Redis Stream
-                    try:
-                        msg_id = redis_client.xadd(stream_key, message_payload)
-                        batch_count += 1
-                        
-                        # Only trim every 100 writes to reduce overhead
-                        skip_trim_counter += 1
-                        if skip_trim_counter >= 100:
-                            stream_trim_seconds = 120
-                            min_id_timestamp = int((time.time() - stream_trim_seconds) * 1000)
-                            try:
-                                redis_client.execute_command('XTRIM', stream_key, 'MINID', '~',
-                                                             f'{min_id_timestamp}-0')
-                            except Exception as e:
-                                pass  # Ignore trim errors
-                            skip_trim_counter = 0
-                    except Exception as e:
-                        print(f"[wave worker] {rname}={ringid} redis write failed: {e}", file=sys.stderr)
+                if stream_key is not None:
+                    now = time.monotonic()  # one clock read per wave
+                    if not pending:
+                        flush_deadline = now + WAVE_PIPELINE_MAX_DELAY
+
+                    # Queue onto the Redis Stream pipeline
+                    pipe.xadd(stream_key, res)
+                    pending += 1
+                    touched_keys.add(stream_key)
+                    if stream_key not in registered_keys and stream_key not in registering_keys:
+                        pipe.sadd(WAVE_STREAM_REGISTRY, stream_key)
+                        registering_keys.add(stream_key)
+
+                    # Periodic trim of every stream touched since the last one,
+                    # riding on the next pipeline flush. The same streams are
+                    # re-added to the registry, so it recovers if Redis loses
+                    # the set (e.g. a restart without persistence).
+                    if now >= trim_deadline:
+                        min_id = f"{int((time.time() - WAVE_STREAM_SECONDS) * 1000)}-0"
+                        for key in touched_keys:
+                            pipe.execute_command('XTRIM', key, 'MINID', '~', min_id)
+                        pipe.sadd(WAVE_STREAM_REGISTRY, *touched_keys)
+                        touched_keys.clear()
+                        trim_deadline = now + WAVE_TRIM_INTERVAL
+
+                    if pending >= WAVE_PIPELINE_SIZE or now >= flush_deadline:
+                        flush()
                         
                 # Log statistics every 100 waves
                 if wave_count % 1000 == 0:
                     print(f"[wave worker] {rname}={ringid} processed {wave_count} waves, {batch_count} written to Redis")
                     
             else:
-                time.sleep(poll_delay)
+                flush()  # ring is idle: don't hold back queued waves
+                time.sleep(idle_sleep)
+                idle_sleep = min(idle_sleep * 2, poll_delay)
     except KeyboardInterrupt:
         pass
     finally:
-        # Attempt safe detach
+        flush()
         try:
-            module.OK = False
-            module.default_ring.detach()
+            t.detach()
         except Exception:
             pass
-        for r in getattr(module, "ringcom", []):
-            try:
-                r.detach()
-            except Exception:
-                pass
         print(f"[wave worker] {rname}={ringid} stopped")
 
 
@@ -241,7 +434,7 @@ def worker_text_or_binary(rname, ringid, modid, instid, msg_type, poll_delay,
         f"[{category} worker] {rname}={ringid} msg_type={msg_type} starting")
     
     try:
-        redis_client = redis.Redis(**redis_cfg)
+        redis_client = connect_redis(redis_cfg)
         redis_client.ping()
         print(f"[{category} worker] {rname}={ringid} connected to Redis.")
     except Exception as e:
@@ -250,21 +443,25 @@ def worker_text_or_binary(rname, ringid, modid, instid, msg_type, poll_delay,
 
     t = transport(ringid, modid, instid)
     t.flush()
+    copymsg_type = t.copymsg_type  # bind once, keep attribute lookups off the hot loop
+    idle_min = min(IDLE_SLEEP_MIN, poll_delay)
+    idle_sleep = idle_min
+    # If no msg_type known, try a generic approach: try copying any msg (type=0 in req),
+    # then filter by instid if needed. Here we just call copymsg_type(0) to get something
+    # that the ring returns (this may not return the desired messages in some configs).
+    # Decided once here rather than on every read.
+    read_type = msg_type if msg_type is not None else 0
     try:
-        while True:
-            if msg_type is not None:
-                msg = t.copymsg_type(msg_type)
-            else:
-                # If no msg_type known, try a generic approach: try copying any msg (type=0 in req),
-                # then filter by instid if needed. Here we just call copymsg_type(0) to get something
-                # that the ring returns (this may not return the desired messages in some configs).
-                msg = t.copymsg_type(0)
+        while not stop_event.is_set():
+            msg = copymsg_type(read_type)
             if msg != (0, 0):
+                idle_sleep = idle_min
                 # msg is (status, rlen, realmsg) per PyEW.copymsg_type
                 status, rlen, realmsg = msg
                 if rlen <= 0:
                     continue
-                payload = realmsg[:rlen]
+                # memoryview slice: no per-message copy of the ring buffer
+                payload = memoryview(realmsg)[:rlen]
                 kind, body = parse_text_message(payload)
                 
                 # Print to stdout
@@ -279,27 +476,31 @@ def worker_text_or_binary(rname, ringid, modid, instid, msg_type, poll_delay,
                 if category == "pick":
                     # Try to parse pick message
                     try:
-                        text_payload = payload.decode('utf-8')
+                        text_payload = str(payload, 'utf-8')
                         parsed_pick = parse_pick_msg(text_payload)
                         if parsed_pick:
-                            msg_data_content = json.dumps(parsed_pick)
+                            msg_data_content = json_dumps(parsed_pick)
                     except Exception as e:
                         print(f"[{category} worker] parse error: {e}", file=sys.stderr)
 
                 msg_data = {
-                    "data": msg_data_content,  # Redis-py handles bytes or string
+                    "data": msg_data_content,  # Redis-py handles bytes, memoryview or string
                     "recv_time": time.time()
                 }
                 
                 try:
-                    redis_client.xadd(stream_key, msg_data)
+                    # XADD + XTRIM in a single round-trip
+                    pipe = redis_client.pipeline(transaction=False)
+                    pipe.xadd(stream_key, msg_data)
                     # Trim stream to keep it manageable (e.g., last 1000 items)
-                    redis_client.xtrim(stream_key, maxlen=10000, approximate=True)
+                    pipe.xtrim(stream_key, maxlen=10000, approximate=True)
+                    pipe.execute()
                 except Exception as e:
                     print(f"[{category} worker] redis write failed: {e}", file=sys.stderr)
 
             else:
-                time.sleep(poll_delay)
+                time.sleep(idle_sleep)
+                idle_sleep = min(idle_sleep * 2, poll_delay)
     except KeyboardInterrupt:
         pass
     finally:
@@ -310,10 +511,30 @@ def worker_text_or_binary(rname, ringid, modid, instid, msg_type, poll_delay,
         print(f"[{category} worker] {rname}={ringid} stopped")
 
 
+def connect_redis(redis_cfg):
+    """Redis client from redis_config-style kwargs, a {"url": ...} dict or a connection_pool."""
+    if "url" in redis_cfg:
+        return redis.Redis.from_url(redis_cfg["url"])
+    return redis.Redis(**redis_cfg)
+
+
+def _spawn(target, args, use_threads):
+    """Start target(*args) as a daemon thread or a daemon process."""
+    if use_threads:
+        w = threading.Thread(target=target, args=args, daemon=True)
+    else:
+        w = mp.Process(target=target, args=args)
+        w.daemon = True
+    w.start()
+    return w
+
+
 def start_workers_for_profile(profile_name, profile_cfg, msg_type_map,
-                              poll_delay=0.001):
+                              poll_delay=0.001, use_threads=False,
+                              redis_cfg=None):
     """
-    Start processes for all rings defined in a profile. Returns list of Process objects.
+    Start workers for all rings defined in a profile. Returns list of Process
+    (or Thread, if use_threads) objects.
     profile_cfg is expected to have:
         - inst_id
         - wave: dict of {name: ringid}
@@ -323,47 +544,58 @@ def start_workers_for_profile(profile_name, profile_cfg, msg_type_map,
     procs = []
     inst_id = profile_cfg.get("inst_id", 255)
     mod_id = 2  # configurable fallback; adjust if you need a different mod id
+    if redis_cfg is None:
+        redis_cfg = redis_config
 
     # waves: for each ring defined, spawn worker_wave
     for rname, ringid in profile_cfg.get("wave", {}).items():
-        p = mp.Process(target=worker_wave,
-                        args=(profile_name, ringid, mod_id, inst_id, poll_delay, redis_config))
-        p.daemon = True
-        p.start()
-        procs.append(p)
+        procs.append(_spawn(worker_wave,
+                            (profile_name, ringid, mod_id, inst_id,
+                             msg_type_map.get("wave", 19), poll_delay, redis_cfg),
+                            use_threads))
         print(f"[wave worker] {profile_name}={ringid} started")
 
     # picks
     for rname, ringid in profile_cfg.get("pick", {}).items():
-        p = mp.Process(target=worker_text_or_binary,
-                        args=(profile_name, ringid, mod_id, inst_id,
-                                msg_type_map.get("pick"), poll_delay, "pick", redis_config))
-        p.daemon = True
-        p.start()
-        procs.append(p)
+        procs.append(_spawn(worker_text_or_binary,
+                            (profile_name, ringid, mod_id, inst_id,
+                             msg_type_map.get("pick"), poll_delay, "pick", redis_cfg),
+                            use_threads))
         print(f"[pick worker] {profile_name}={ringid} started")
 
     # eew
     for rname, ringid in profile_cfg.get("eew", {}).items():
-        p = mp.Process(target=worker_text_or_binary,
-                        args=(rname, ringid, mod_id, inst_id,
-                                msg_type_map.get("eew"), poll_delay, "eew", redis_config))
-        p.daemon = True
-        p.start()
-        procs.append(p)
+        procs.append(_spawn(worker_text_or_binary,
+                            (rname, ringid, mod_id, inst_id,
+                             msg_type_map.get("eew"), poll_delay, "eew", redis_cfg),
+                            use_threads))
         print(f"[eew worker] {profile_name}={ringid} started")
 
     return procs
 
 
-def main(profiles_to_run=None, poll_delay=0.001):
+def main(profiles_to_run=None, poll_delay=0.001, use_threads=False):
     """
     Launch workers for requested profiles (keys in earthworm_param).
     If profiles_to_run is None, launch for all profiles in earthworm_param.
+    With use_threads, every ring gets a thread in this process and all of
+    them share one Redis connection pool.
     """
     if profiles_to_run is None:
         profiles_to_run = list(earthworm_param.keys())
 
+    if not redis.utils.HIREDIS_AVAILABLE:
+        print("hiredis not installed: redis-py falls back to its pure-Python reply parser "
+              "(pip install 'redis[hiredis]')", file=sys.stderr)
+
+    redis_cfg = redis_config
+    if use_threads:
+        if "url" in redis_config:
+            pool = redis.ConnectionPool.from_url(redis_config["url"])
+        else:
+            pool = redis.ConnectionPool(**redis_config)
+        redis_cfg = {"connection_pool": pool}
+
     all_procs = []
     for prof in profiles_to_run:
         cfg = earthworm_param.get(prof)
@@ -371,7 +603,9 @@ def main(profiles_to_run=None, poll_delay=0.001):
             print(f"No configuration for profile '{prof}', skipping.")
             continue
         procs = start_workers_for_profile(prof, cfg, MSG_TYPE_MAP,
-                                          poll_delay=poll_delay)
+                                          poll_delay=poll_delay,
+                                          use_threads=use_threads,
+                                          redis_cfg=redis_cfg)
         all_procs.extend(procs)
 
     print("All workers started. Press Ctrl-C to stop.")
@@ -384,9 +618,11 @@ def main(profiles_to_run=None, poll_delay=0.001):
     except KeyboardInterrupt:
         print("Shutdown requested, terminating workers...")
     finally:
+        stop_event.set()
         for p in all_procs:
             try:
-                p.terminate()
+                if hasattr(p, "terminate"):
+                    p.terminate()
             except Exception:
                 pass
         for p in all_procs:
@@ -401,7 +637,10 @@ if __name__ == "__main__":
                         help="Which profiles to run (from earthworm_param).")
     parser.add_argument("--delay", "-d", type=float, default=0.01,
                         help="Poll delay when no message (s).")
+    parser.add_argument("--threads", action="store_true",
+                        help="Run one thread per ring in a single process "
+                             "instead of one process per ring.")
     args = parser.parse_args()
 
     # If you want to only run certain profiles: python example_multi_reader.py -p test jimmy
-    main(profiles_to_run=args.env, poll_delay=args.delay)
+    main(profiles_to_run=args.env, poll_delay=args.delay, use_threads=args.threads)
@@ -2,16 +2,54 @@ import asyncio
 import time
 import argparse
 import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, partial
+from operator import itemgetter
+from collections import defaultdict, deque
 from typing import List, Set, Dict
 import redis.asyncio as redis
+from redis.utils import HIREDIS_AVAILABLE
 import numpy as np
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect
 from loguru import logger
 import uvicorn
 import pandas as pd
-from scipy.signal import detrend, iirfilter, sosfilt, zpk2sos
+from scipy.signal import iirfilter, sosfilt
 import json
 
+try:
+    from numba import njit, prange
+except ImportError:  # numba 為選用套件，沒有時 batch_signal_processing 改用 scipy.signal.sosfilt
+    njit = None
+
+try:
+    import cupy as cp
+    from cupyx.scipy.signal import sosfilt as cupy_sosfilt
+except ImportError:  # cupy 為選用套件，只在有 GPU 的主機上加速大批次（歷史資料）濾波
+    cp = None
+    cupy_sosfilt = None
+
+def _json_default(obj):
+    # numpy 陣列與純量轉成 Python 型別（orjson 只直接處理 C-contiguous 陣列，
+    # 降採樣後的 waveform[::factor] view 也會走到這裡）
+    if isinstance(obj, (np.ndarray, np.generic)):
+        return obj.tolist()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+try:
+    import orjson
+    from orjson import loads as json_loads  # 直接解析 bytes，錯誤為 json.JSONDecodeError 的子類別
+
+    def json_dumps(obj) -> bytes:
+        # orjson 直接輸出 UTF-8 bytes，並可序列化 numpy 陣列與純量
+        return orjson.dumps(obj, default=_json_default, option=orjson.OPT_SERIALIZE_NUMPY)
+except ImportError:  # orjson 為選用套件，沒有時改用標準庫 json
+    from json import loads as json_loads
+
+    def json_dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False, default=_json_default).encode("utf-8")
+
 # --- Redis 和 FastAPI 配置 ---
 REDIS_CONFIG = {
     "host": os.getenv("REDIS_HOST", "localhost"),
@@ -19,52 +57,173 @@ REDIS_CONFIG = {
     "db": 0,
 }
 
+# 所有 Redis client 共用的連線池：歷史資料請求不必每次重新建立 TCP 連線；
+# 連線用完時等待（BlockingConnectionPool）而不是丟出 "Too many connections"
+REDIS_MAX_CONNECTIONS = 32
+redis_pool = redis.BlockingConnectionPool(**REDIS_CONFIG, decode_responses=False, max_connections=REDIS_MAX_CONNECTIONS)
+
+# 長輪詢 XREAD 的背景 reader 各自從連線池取一條連線獨佔，不必每次向 pool 取還連線
+READER_REDIS_CONFIG = {"connection_pool": redis_pool, "single_connection_client": True}
+
 # --- 波形降採樣配置 ---
 # 控制傳送資料點數的倍數：資料點數 = resolution_width * POINTS_PER_PIXEL
 # 預設 2.0 表示傳送解析度兩倍的資料點，可調整以平衡畫質與傳輸量
 POINTS_PER_PIXEL = 1.0
 FIXED_TIME_WINDOW = 120  # 固定時間窗口（秒）
+# 降採樣因子下限（環境變數 DISPLAY_DECIM），例如 2 表示至少每 2 點取 1 點
+# 波形已先經 10 Hz 低通濾波，100 Hz 資料降到 5 倍以內不會產生混疊
+MIN_DOWNSAMPLE_FACTOR = max(1, int(os.getenv("DISPLAY_DECIM", "1")))
+
+# 批次樣本數（列數 x 最長長度）達此值才改用 GPU 濾波，小批次搬運成本高於運算
+GPU_MIN_SAMPLES = 200_000
+
+# 歷史資料每個 pipeline 的 XRANGE 數量，多個 pipeline 並行
+HISTORICAL_PIPELINE_CHUNK = 256
+
+# redis_wave_reader 讀到、尚未處理的 XREAD 結果上限
+WAVE_RESPONSE_QUEUE_SIZE = 4
+
+# 每個客戶端最多暫存的波形 frame 數，送不完時丟棄最舊的（pick/EEW 不受限制）
+CLIENT_WAVE_QUEUE_SIZE = 8
+
+# --- WebSocket permessage-deflate 配置 ---
+# WS_DEFLATE=0 關閉壓縮（預設開啟，與 uvicorn 相同）；壓縮等級預設 1（zlib BEST_SPEED）
+WS_DEFLATE = os.getenv("WS_DEFLATE", "1") != "0"
+WS_DEFLATE_LEVEL = int(os.getenv("WS_DEFLATE_LEVEL", "1"))
+
+# reader_pyew_to_redis.py 維護的波形 stream key 集合（SET）
+WAVE_STREAM_REGISTRY = "wave_streams"
+# 每隔幾秒仍以 SCAN 核對一次，補上集合中缺少的 stream（舊版 reader、SADD 失敗、Redis 重啟）
+WAVE_STREAM_RESCAN_INTERVAL = 60.0
 
 app = FastAPI()
 background_tasks = set()
 
+# batch_signal_processing 在此執行緒執行（numba/scipy 會釋放 GIL），不阻塞 event loop。
+# 只用一個執行緒：numba 預設的 workqueue threading layer 不允許多個執行緒同時執行 parallel kernel
+signal_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="signal")
+
+# --- 每個客戶端的傳送佇列 ---
+class ClientSender:
+    """
+    每個客戶端各自的傳送佇列與傳送 task，慢速客戶端只會拖慢自己；
+    只有 run() 會對 websocket 呼叫 send，避免多個 task 同時寫入同一連線。
+    訊息（pick/EEW、歷史資料等，文字或二進位）依序優先送出且不丟棄；
+    即時波形 frame 最多暫存 CLIENT_WAVE_QUEUE_SIZE 個，滿了丟棄最舊的（只保留最新的波形）。
+    """
+
+    def __init__(self, websocket: WebSocket, on_error):
+        self.websocket = websocket
+        self.on_error = on_error  # 傳送失敗時呼叫 on_error(websocket)
+        self.messages = deque()
+        self.waves = deque(maxlen=CLIENT_WAVE_QUEUE_SIZE)
+        self.dropped_waves = 0
+        self.pending = asyncio.Event()
+        self.task = asyncio.create_task(self.run())
+
+    def put_message(self, message):
+        """message 為 str（文字 frame）或 bytes（二進位 frame）"""
+        self.messages.append(message)
+        self.pending.set()
+
+    def put_wave(self, frame: bytes):
+        if len(self.waves) == self.waves.maxlen:
+            self.dropped_waves += 1  # deque(maxlen) 會自動丟掉最舊的
+        self.waves.append(frame)
+        self.pending.set()
+
+    async def run(self):
+        try:
+            while True:
+                await self.pending.wait()
+                self.pending.clear()
+                while self.messages or self.waves:
+                    if self.messages:
+                        message = self.messages.popleft()
+                        if isinstance(message, bytes):
+                            await self.websocket.send_bytes(message)
+                        else:
+                            await self.websocket.send_text(message)
+                    else:
+                        await self.websocket.send_bytes(self.waves.popleft())
+        except Exception as e:
+            logger.error(f"Failed to send to {self.websocket.client.host}: {e}")
+            self.on_error(self.websocket)
+            # 關閉連線，讓此客戶端的接收迴圈結束，不再處理它之後送來的訂閱
+            try:
+                await self.websocket.close()
+            except Exception:
+                pass
+
 # --- WebSocket 連線管理器 ---
 class ConnectionManager:
     def __init__(self):
         self.active_connections: List[WebSocket] = []
         self.subscribed_stations: Dict[WebSocket, Set[str]] = {}
         self.client_resolutions: Dict[WebSocket, int] = {}  # 儲存每個客戶端的螢幕解析度
+        # 反向索引：測站簡碼 -> 訂閱該測站的客戶端；"__ALL_Z__" 壓力測試訂閱另外記錄
+        self.station_to_sockets: Dict[str, Set[WebSocket]] = defaultdict(set)
+        self.all_z_sockets: Set[WebSocket] = set()
+        self.senders: Dict[WebSocket, ClientSender] = {}
 
     async def connect(self, websocket: WebSocket):
         await websocket.accept()
         self.active_connections.append(websocket)
         self.subscribed_stations[websocket] = set()
+        self.senders[websocket] = ClientSender(websocket, self.disconnect)
         logger.info(f"Client {websocket.client.host} connected")
         # 通知前端連線已建立，可以開始訂閱
-        await websocket.send_json({"event": "connect_init"})
+        await self.send_personal_message(websocket, {"event": "connect_init"})
 
     def disconnect(self, websocket: WebSocket):
+        if websocket not in self.senders:
+            return  # 已經移除（傳送失敗時會先移除，之後接收迴圈結束時會再呼叫一次）
         self.active_connections.remove(websocket)
-        if websocket in self.subscribed_stations:
-            del self.subscribed_stations[websocket]
+        self._unindex(websocket)
+        del self.subscribed_stations[websocket]
         if websocket in self.client_resolutions:
             del self.client_resolutions[websocket]
+        sender = self.senders.pop(websocket)
+        if sender.task is not asyncio.current_task():  # 傳送失敗時由 sender 自己呼叫，task 會自行結束
+            sender.task.cancel()
+        if sender.dropped_waves:
+            logger.warning(f"Client {websocket.client.host} was too slow, dropped {sender.dropped_waves} wave packets")
         logger.info(f"Client {websocket.client.host} disconnected")
 
     def subscribe(self, websocket: WebSocket, stations: List[str]):
         """處理來自客戶端的測站訂閱請求"""
+        if websocket not in self.senders:
+            return  # 已斷線（傳送失敗）的客戶端，不再加回訂閱與索引
+        self._unindex(websocket)
         if stations:
             # 前端傳來的可能是 'TWQ1' 或 'A024' 這種簡碼
             self.subscribed_stations[websocket] = set(stations)
+            if "__ALL_Z__" in self.subscribed_stations[websocket]:
+                self.all_z_sockets.add(websocket)
+            else:
+                for station in self.subscribed_stations[websocket]:
+                    self.station_to_sockets[station].add(websocket)
             logger.info(
                 f"Client {websocket.client.host} subscribed to {len(stations)} stations: {list(stations)[:10]}..."
             )
         else:
             self.subscribed_stations[websocket] = set()
             logger.info(f"Client {websocket.client.host} unsubscribed from all stations")
+
+    def _unindex(self, websocket: WebSocket):
+        """從反向索引移除此客戶端目前的訂閱"""
+        self.all_z_sockets.discard(websocket)
+        for station in self.subscribed_stations.get(websocket, ()):
+            sockets = self.station_to_sockets.get(station)
+            if sockets is not None:
+                sockets.discard(websocket)
+                if not sockets:
+                    del self.station_to_sockets[station]
     
     def set_resolution(self, websocket: WebSocket, width: int):
         """設定客戶端的顯示解析度"""
+        if websocket not in self.senders:
+            return  # 已斷線（傳送失敗）的客戶端
         self.client_resolutions[websocket] = width
         logger.info(f"Client {websocket.client.host} set resolution to {width}px")
 
@@ -74,85 +233,109 @@ class ConnectionManager:
         if not wave_batch:
             return
 
-        # 遍歷所有連線
-        for websocket, subscribed_codes in self.subscribed_stations.items():
-            if not subscribed_codes:
+        # 只走訪一次 wave_batch，經由反向索引分配給各客戶端
+        per_socket: Dict[WebSocket, List[str]] = {}
+        for wave_id in wave_batch:
+            # wave_id 格式為 'SM.A024.01.HLZ'，訂閱的是 'A024' 這種簡碼
+            parts = wave_id.split(".")
+            if len(parts) < 2:
                 continue
-
-            filtered_batch = {}
-            # 檢查是否有壓力測試的特殊訂閱
-            if "__ALL_Z__" in subscribed_codes:
-                # 過濾出所有 Z 軸的資料
-                filtered_batch = {
-                    wave_id: wave_data
-                    for wave_id, wave_data in wave_batch.items()
-                    if len(wave_id.split(".")) >= 4 and wave_id.split(".")[3].endswith("Z")
-                }
-            else:
-                # 原本的過濾邏輯
-                # wave_id 格式為 'SM.A024.01.HLZ'，subscribed_codes 可能是 'A024'
-                filtered_batch = {
-                    wave_id: wave_data
-                    for wave_id, wave_data in wave_batch.items()
-                    if len(wave_id.split(".")) >= 2 and wave_id.split(".")[1] in subscribed_codes
-                }
-
-            if filtered_batch:
-                # 根據客戶端解析度進行降採樣
-                resolution_width = self.client_resolutions.get(websocket, 1000)  # 預設 1000
+            targets = self.station_to_sockets.get(parts[1])
+            if targets:
+                for websocket in targets:
+                    per_socket.setdefault(websocket, []).append(wave_id)
+            # 壓力測試的特殊訂閱：所有 Z 軸的資料
+            if self.all_z_sockets and len(parts) >= 4 and parts[3].endswith("Z"):
+                for websocket in self.all_z_sockets:
+                    per_socket.setdefault(websocket, []).append(wave_id)
+
+        # 訂閱內容與解析度相同的客戶端共用同一個 frame，只打包一次
+        frames = {}  # (wave_ids, resolution_width) -> bytes
+        for websocket, wave_ids in per_socket.items():
+            sender = self.senders.get(websocket)
+            if sender is None:
+                continue  # 已斷線（傳送失敗）的客戶端
+            wave_ids = tuple(wave_ids)
+            resolution_width = self.client_resolutions.get(websocket, 1000)  # 預設 1000
+            key = (wave_ids, resolution_width)
+            frame = frames.get(key)
+            if frame is None:
+                frame = self._pack_wave_frame(wave_packet, wave_ids, resolution_width)
+                frames[key] = frame
+            # 放入客戶端各自的佇列，由其傳送 task 送出，單一慢速客戶端不會拖住其他人
+            sender.put_wave(frame)
+
+    @staticmethod
+    def _pack_wave_frame(wave_packet: dict, wave_ids: tuple, resolution_width: int) -> bytes:
+        """依客戶端解析度降採樣 wave_ids 中的波形，打包成二進位 frame"""
+        wave_batch = wave_packet["data"]
+        downsampled_batch = {}
+        waveforms = []  # 依序放入二進位封包的 float32 波形
+        offset = 0
+        for wave_id in wave_ids:
+            wave_data = wave_batch[wave_id]
+            waveform = wave_data.get("waveform")
+            samprate = wave_data.get("samprate", 100)
+            
+            if waveform is not None and len(waveform) > 0:
+                # 計算降採樣因子
+                downsample_factor = calculate_downsample_factor(samprate, resolution_width)
                 
-                downsampled_batch = {}
-                for wave_id, wave_data in filtered_batch.items():
-                    waveform = wave_data.get("waveform", [])
-                    samprate = wave_data.get("samprate", 100)
-                    
-                    if waveform and len(waveform) > 0:
-                        # 計算降採樣因子
-                        downsample_factor = calculate_downsample_factor(samprate, resolution_width)
-                        
-                        # 執行降採樣
-                        downsampled_waveform = downsample_waveform(np.array(waveform), downsample_factor)
-                        
-                        # 建立降採樣後的資料
-                        downsampled_batch[wave_id] = {
-                            **wave_data,
-                            "waveform": downsampled_waveform.tolist(),
-                            "samprate": samprate,  # 保留原始採樣率
-                            "effective_samprate": samprate / downsample_factor,  # 降採樣後的有效採樣率
-                            "original_length": len(waveform),
-                            "downsampled_length": len(downsampled_waveform),
-                            "downsample_factor": downsample_factor
-                        }
-                    else:
-                        downsampled_batch[wave_id] = wave_data
+                # 執行降採樣
+                downsampled_waveform = downsample_waveform(np.asarray(waveform), downsample_factor)
                 
-                # 建立針對此客戶端的資料包
-                client_packet = {
-                    "waveid": wave_packet["waveid"],
-                    "timestamp": wave_packet["timestamp"],
-                    "data": downsampled_batch,
+                # 建立降採樣後的資料，waveform 以 [offset, length] 指向樣本區
+                downsampled_batch[wave_id] = {
+                    **wave_data,
+                    "waveform": [offset, len(downsampled_waveform)],
+                    "samprate": samprate,  # 保留原始採樣率
+                    "effective_samprate": samprate / downsample_factor,  # 降採樣後的有效採樣率
+                    "original_length": len(waveform),
+                    "downsampled_length": len(downsampled_waveform),
+                    "downsample_factor": downsample_factor
                 }
-                try:
-                    # 發送資料
-                    await websocket.send_json({"event": "wave_packet", "data": client_packet})
-                except Exception as e:
-                    logger.error(f"Failed to send to {websocket.client.host}: {e}")
+                waveforms.append(downsampled_waveform)
+                offset += len(downsampled_waveform)
+            else:
+                downsampled_batch[wave_id] = {**wave_data, "waveform": [offset, 0]}
+        
+        # 建立針對此客戶端的資料包（二進位 frame，樣本不經 JSON 編碼）
+        client_packet = {
+            "waveid": wave_packet["waveid"],
+            "timestamp": wave_packet["timestamp"],
+            "data": downsampled_batch,
+        }
+        return pack_binary_frame({"event": "wave_packet", "data": client_packet}, waveforms)
+
+    async def send_personal_message(self, websocket: WebSocket, message):
+        """
+        將訊息放入單一客戶端的優先佇列（不丟棄）。
+        message 為 dict（以 json_dumps 編碼成文字 frame）或已打包好的 bytes（二進位 frame）。
+        """
+        sender = self.senders.get(websocket)
+        if sender is None:
+            return  # 已斷線（傳送失敗）的客戶端
+        if isinstance(message, dict):
+            message = json_dumps(message).decode("utf-8")
+        sender.put_message(message)
+
+    async def broadcast(self, message: dict):
+        """將訊息廣播給所有連線的客戶端：只序列化一次，放入各客戶端的優先佇列"""
+        if not self.senders:
+            return
+
+        # 只序列化一次，所有客戶端共用同一份字串
+        text = json_dumps(message).decode("utf-8")
+        for sender in self.senders.values():
+            sender.put_message(text)
 
     async def send_pick_packet(self, pick_data: dict):
         """將 PICK 資料包傳送給所有連線的客戶端 (廣播)"""
-        for websocket in self.active_connections:
-            try:
-                await websocket.send_json({"event": "pick_packet", "data": pick_data})
-            except Exception as e:
-                logger.error(f"Failed to send pick to {websocket.client.host}: {e}")
+        await self.broadcast({"event": "pick_packet", "data": pick_data})
 
     async def send_eew_packet(self, eew_data: dict):
         """將 EEW 資料包傳送給所有連線的客戶端 (廣播)"""
-        for websocket in self.active_connections:
-            try:
-                await websocket.send_json({"event": "eew_packet", "data": eew_data})
-            except Exception as e:
-                logger.error(f"Failed to send eew to {websocket.client.host}: {e}")
+        await self.broadcast({"event": "eew_packet", "data": eew_data})
 
 socket_manager = ConnectionManager()
 
@@ -184,8 +367,8 @@ async def websocket_endpoint(websocket: WebSocket):
 
                 logger.info(f"Client {websocket.client.host} requested {window_seconds}s of historical data for {len(stations)} stations")
                 
-                # Create Redis client for this request
-                redis_client = redis.Redis(**REDIS_CONFIG, decode_responses=False)
+                # Client on the shared pool (no new TCP connection per request)
+                redis_client = redis.Redis(connection_pool=redis_pool)
                 
                 try:
                     # Calculate time range
@@ -196,18 +379,16 @@ async def websocket_endpoint(websocket: WebSocket):
                     stream_keys = []
                     
                     # Handle special __ALL_Z__ marker for stress testing
+                    # All wave:*:*Z streams (matches HLZ, ENZ, BHZ, etc.), fetched once
+                    all_z_keys = await get_z_stream_keys(redis_client)
                     if stations == ['__ALL_Z__']:
-                        logger.info(f"Client requested __ALL_Z__ - scanning all Z channel streams in Redis")
-                        # Scan all wave:*:*Z streams (matches HLZ, ENZ, BHZ, etc.)
-                        all_z_keys = [key async for key in redis_client.scan_iter("wave:*:*Z")]
+                        logger.info(f"Client requested __ALL_Z__ - using all Z channel streams in Redis")
                         stream_keys = all_z_keys
                         logger.info(f"Found {len(stream_keys)} Z-channel streams")
                     else:
-                        # Normal station list - find Z channels for each station
-                        for station in stations:
-                            # Scan for all Z channels for this station (wave:STATION:*Z)
-                            station_z_keys = [key async for key in redis_client.scan_iter(f"wave:{station}:*Z")]
-                            stream_keys.extend(station_z_keys)
+                        # Normal station list - keep the Z channels of the requested stations (wave:STATION:*Z)
+                        wanted = {station.encode('utf-8') for station in stations}
+                        stream_keys = [key for key in all_z_keys if key.split(b":")[1] in wanted]
                         logger.info(f"Found {len(stream_keys)} Z-channel streams for {len(stations)} stations")
                     
                     logger.info(f"Querying historical data: start_time={start_time}, end_time={end_time}, stations={stations[:5]}...")
@@ -218,7 +399,7 @@ async def websocket_endpoint(websocket: WebSocket):
                     
                     # Fetch historical data using pipeline
                     fetch_start = time.time()
-                    wave_packets = await get_historical_waves_bulk(
+                    wave_batch = await get_historical_waves_bulk(
                         redis_client, 
                         stream_keys, 
                         start_time, 
@@ -227,22 +408,19 @@ async def websocket_endpoint(websocket: WebSocket):
                     )
                     fetch_time = time.time() - fetch_start
                     
-                    if wave_packets:
-                        # Send multiple packets to client (one per time group)
-                        logger.info(f"Fetched {len(wave_packets)} historical time-grouped packets in {fetch_time:.3f}s")
+                    if wave_batch:
+                        # One packet carrying each station's full-duration waveform
+                        logger.info(f"Fetched {len(wave_batch)} historical waveforms in {fetch_time:.3f}s")
                         
-                        for i, wave_batch in enumerate(wave_packets):
-                            timestamp = int(time.time() * 1000)
-                            wave_packet = {
-                                "waveid": f"historical_{timestamp}_{i}",
-                                "timestamp": timestamp,
-                                "data": wave_batch,
-                            }
-                            await websocket.send_json({"event": "historical_data", "data": wave_packet})
-                            # Small delay to avoid overwhelming client
-                            await asyncio.sleep(0.1)
+                        timestamp = int(time.time() * 1000)
+                        wave_packet = {
+                            "waveid": f"historical_{timestamp}",
+                            "timestamp": timestamp,
+                            "data": wave_batch,
+                        }
+                        await socket_manager.send_personal_message(websocket, pack_wave_batch_frame("historical_data", wave_packet))
                         
-                        logger.info(f"Sent {len(wave_packets)} historical wave packets to client")
+                        logger.info("Queued historical wave packet for client")
                         
                         # Also fetch and send historical picks
                         try:
@@ -250,7 +428,7 @@ async def websocket_endpoint(websocket: WebSocket):
                             if pick_packets:
                                 logger.info(f"Sending {len(pick_packets)} historical picks in one batch to client")
                                 # 一次發送所有 picks
-                                await websocket.send_json({
+                                await socket_manager.send_personal_message(websocket, {
                                     "event": "historical_picks_batch", 
                                     "data": {
                                         "picks": pick_packets,
@@ -262,13 +440,11 @@ async def websocket_endpoint(websocket: WebSocket):
                     else:
                         logger.warning(f"No historical data found for requested stations: {stations[:10]}")
                         logger.warning(f"Checked stream keys: {[k.decode('utf-8') for k in stream_keys[:10]]}")
-                        await websocket.send_json({"event": "historical_data", "data": {"waveid": "empty", "timestamp": int(time.time() * 1000), "data": {}}})
+                        await socket_manager.send_personal_message(websocket, {"event": "historical_data", "data": {"waveid": "empty", "timestamp": int(time.time() * 1000), "data": {}}})
                 
                 except Exception as e:
                     logger.error(f"Error fetching historical data: {e}")
-                    await websocket.send_json({"event": "error", "data": {"message": f"Failed to fetch historical data: {str(e)}"}})
-                finally:
-                    await redis_client.close()
+                    await socket_manager.send_personal_message(websocket, {"event": "error", "data": {"message": f"Failed to fetch historical data: {str(e)}"}})
 
     except WebSocketDisconnect:
         socket_manager.disconnect(websocket)
@@ -279,6 +455,42 @@ async def websocket_endpoint(websocket: WebSocket):
 
 
 # --- 從 Redis 讀取並推送資料的背景任務 ---
+# get_z_stream_keys 上次 SCAN 找到、但不在 WAVE_STREAM_REGISTRY 中的 key
+_unregistered_z_keys = set()
+_z_stream_rescan_deadline = 0.0
+
+async def get_z_stream_keys(redis_client):
+    """
+    Return all Z-channel wave stream keys (bytes, e.g. b'wave:A001:HLZ').
+    Reads the WAVE_STREAM_REGISTRY set kept by the ring reader (one SMEMBERS).
+    The set is a fast path, not the source of truth: every
+    WAVE_STREAM_RESCAN_INTERVAL seconds (and whenever the set is empty) the
+    keyspace is also SCANned for 'wave:*:*Z', and streams missing from the set
+    are remembered and returned as well.
+    """
+    global _z_stream_rescan_deadline
+    keys = {key for key in await redis_client.smembers(WAVE_STREAM_REGISTRY) if key.endswith(b"Z")}
+    now = time.monotonic()
+    if not keys or now >= _z_stream_rescan_deadline:
+        _z_stream_rescan_deadline = now + WAVE_STREAM_RESCAN_INTERVAL
+        # COUNT 1024: the default of 10 keys per SCAN costs one round-trip per handful of streams
+        scanned = {key async for key in redis_client.scan_iter("wave:*:*Z", count=1024)}
+        missing = scanned - keys
+        if missing and keys:
+            logger.warning(f"{len(missing)} wave streams missing from {WAVE_STREAM_REGISTRY}, e.g. {sorted(missing)[:5]}")
+        _unregistered_z_keys.clear()
+        _unregistered_z_keys.update(missing)
+    keys.update(_unregistered_z_keys)
+    return list(keys)
+
+
+async def xrange_pipeline(redis_client, stream_keys, start_id, end_id):
+    """Run XRANGE for stream_keys in one non-transactional pipeline; returns (stream_keys, results)."""
+    pipeline = redis_client.pipeline(transaction=False)
+    for key in stream_keys:
+        pipeline.xrange(key, min=start_id, max=end_id)
+    return stream_keys, await pipeline.execute()
+
 async def get_historical_waves_bulk(redis_client, stream_keys, start_time, end_time, resolution_width=1000):
     """
     Fetch historical waveform data for multiple streams using Redis Pipeline.
@@ -292,7 +504,7 @@ async def get_historical_waves_bulk(redis_client, stream_keys, start_time, end_t
         resolution_width: Client display width in pixels (for downsampling)
     
     Returns:
-        list: List of wave_batch dicts (one per 5-second window)
+        dict: wave_batch {wave_id: data}, one full-duration waveform per wave_id
     """
     if not stream_keys:
         return {}
@@ -302,70 +514,57 @@ async def get_historical_waves_bulk(redis_client, stream_keys, start_time, end_t
     
     logger.info(f"get_historical_waves_bulk: Querying {len(stream_keys)} streams from {start_id} to {end_id}")
     
-    # Use pipeline to batch all xrange queries
-    pipeline = redis_client.pipeline()
-    for key in stream_keys:
-        pipeline.xrange(key, min=start_id, max=end_id)
-    
-    # Execute all commands in one go
-    results = await pipeline.execute()
-    
-    logger.info(f"get_historical_waves_bulk: Pipeline returned {len(results)} results")
-    
-    # Count how many streams have data
-    streams_with_data = sum(1 for r in results if r)
-    logger.info(f"get_historical_waves_bulk: {streams_with_data}/{len(results)} streams have data")
+    # Split the xrange queries into pipelines of HISTORICAL_PIPELINE_CHUNK keys.
+    # They run concurrently on pooled connections, and each chunk is decoded
+    # as soon as its replies arrive instead of buffering every reply first.
+    chunk_tasks = [
+        asyncio.create_task(xrange_pipeline(redis_client, stream_keys[i:i + HISTORICAL_PIPELINE_CHUNK], start_id, end_id))
+        for i in range(0, len(stream_keys), HISTORICAL_PIPELINE_CHUNK)
+    ]
+    streams_with_data = 0
     
     # Group all chunks by station first (to process full duration at once)
     station_data_map = {}  # {wave_id: {'chunks': [], 'meta': ...}}
     
-    for key, messages in zip(stream_keys, results):
-        if not messages:
-            continue
-        
-        key_str = key.decode('utf-8') if isinstance(key, bytes) else key
-        _, station, channel = key_str.split(":")
-        
-        # Process each message chunk
-        for msg_id, msg_data in messages:
-            waveform_bytes = msg_data.get(b'data')
-            if not waveform_bytes:
-                continue
-            
-            waveform_raw = np.frombuffer(waveform_bytes, dtype=np.int32)
-            
-            # Apply scaling
-            wave_meta = {
-                'station': station, 
-                'channel': channel, 
-                'network': msg_data.get(b'network', b'TW').decode('utf-8')
-            }
-            wave_meta = convert_to_tsmip_legacy_naming(wave_meta)
-            constant = get_wave_constant(wave_meta)
-            waveform_scaled = waveform_raw * constant
-            
-            network = msg_data.get(b'network', b'SM').decode('utf-8')
-            location = msg_data.get(b'location', b'01').decode('utf-8')
-            wave_id = f"{network}.{station}.{location}.{channel}"
+    try:
+        for next_chunk in asyncio.as_completed(chunk_tasks):
+            chunk_keys, results = await next_chunk
+            for key, messages in zip(chunk_keys, results):
+                if not messages:
+                    continue
+                streams_with_data += 1
             
-            startt = float(msg_data.get(b'startt', b'0'))
-            endt = float(msg_data.get(b'endt', b'0'))
-            samprate = int(float(msg_data.get(b'samprate', b'100')))
+                constant = get_stream_constant(key)
             
-            if wave_id not in station_data_map:
-                station_data_map[wave_id] = {
-                    'chunks': [],
-                    'samprate': samprate
-                }
-            
-            station_data_map[wave_id]['chunks'].append({
-                'waveform': waveform_scaled,
-                'startt': startt,
-                'endt': endt
-            })
+                # Process each message chunk: keep the raw counts, scaling is
+                # done once per wave_id after the chunks are put in order
+                for msg_id, msg_data in messages:
+                    waveform_bytes = msg_data.get(b'data')
+                    if not waveform_bytes:
+                        continue
+                
+                    wave_id = get_wave_id(key, msg_data)
+                
+                    data = station_data_map.get(wave_id)
+                    if data is None:
+                        data = station_data_map[wave_id] = {
+                            'chunks': [],
+                            'constant': constant,
+                            'samprate': int(float(msg_data.get(b'samprate', b'100')))
+                        }
+                
+                    # (startt, raw int32 bytes)
+                    data['chunks'].append((float(msg_data.get(b'startt', b'0')), waveform_bytes))
+    finally:
+        # A failed chunk must not leave its siblings running on pooled connections
+        for task in chunk_tasks:
+            task.cancel()
+        await asyncio.gather(*chunk_tasks, return_exceptions=True)
+        
+    logger.info(f"get_historical_waves_bulk: {streams_with_data}/{len(stream_keys)} streams have data")
     
     if not station_data_map:
-        return []
+        return {}
     
     # Concatenate and prepare for batch processing
     wave_ids = []
@@ -376,39 +575,33 @@ async def get_historical_waves_bulk(redis_client, stream_keys, start_time, end_t
     for wave_id, data in station_data_map.items():
         chunks = data['chunks']
         # Sort by time
-        chunks.sort(key=lambda c: c['startt'])
+        chunks.sort(key=itemgetter(0))
         
-        # Concatenate
-        full_waveform = np.concatenate([c['waveform'] for c in chunks])
+        # Scale each chunk's counts straight into one preallocated float32 buffer
+        full_waveform = np.empty(sum(len(c[1]) for c in chunks) // 4, dtype=np.float32)
+        pos = 0
+        for _, waveform_bytes in chunks:
+            counts = np.frombuffer(waveform_bytes, dtype=np.int32)
+            np.multiply(counts, data['constant'], out=full_waveform[pos:pos + len(counts)], dtype=np.float32)
+            pos += len(counts)
         
         wave_ids.append(wave_id)
         full_waveforms.append(full_waveform)
-        wave_start_times.append(chunks[0]['startt'])
+        wave_start_times.append(chunks[0][0])
         wave_samprates.append(data['samprate'])
         
     # Batch process the FULL waveforms
     try:
-        processed_waveforms = batch_signal_processing(full_waveforms)
-        
-        # Apply Taper to the start of each waveform to remove filter spike
-        # Taper first 2 seconds (200 samples at 100Hz)
-        for i, waveform in enumerate(processed_waveforms):
-            if waveform is None or len(waveform) == 0:
-                continue
-                
-            taper_len = min(len(waveform), 200)  # 2 seconds
-            if taper_len > 0:
-                # Simple linear taper (0 to 1)
-                taper = np.linspace(0, 1, taper_len)
-                waveform[:taper_len] = waveform[:taper_len] * taper
+        processed_waveforms = await asyncio.get_running_loop().run_in_executor(
+            signal_executor, batch_signal_processing, full_waveforms
+        )
                 
     except Exception as e:
         logger.error(f"Batch processing error in historical data: {e}")
-        return []
+        return {}
 
-    # Slice back into 5-second packets for transmission
-    TIME_WINDOW = 30  # seconds
-    packet_map = {}  # {time_key: {wave_id: data}}
+    # Send each full waveform as is; the client windows the array itself
+    wave_batch = {}
     
     for i, wave_id in enumerate(wave_ids):
         waveform = processed_waveforms[i]
@@ -417,52 +610,31 @@ async def get_historical_waves_bulk(redis_client, stream_keys, start_time, end_t
             
         start_time = wave_start_times[i]
         samprate = wave_samprates[i]
+        total_samples = len(waveform)
         
-        # Calculate downsample factor once
         downsample_factor = calculate_downsample_factor(samprate, resolution_width)
         
-        # Slice into windows
-        total_samples = len(waveform)
-        samples_per_window = int(TIME_WINDOW * samprate)
+        # Taper the start of the waveform to remove filter spike
+        # (first 2 seconds, 200 samples at 100Hz) and get the PGA of the whole trace
+        taper_len = min(total_samples, 200)
+        pga = taper_and_pga(waveform, taper_len, downsample_factor)
         
-        for j in range(0, total_samples, samples_per_window):
-            chunk_start_idx = j
-            chunk_end_idx = min(j + samples_per_window, total_samples)
-            
-            chunk_waveform = waveform[chunk_start_idx:chunk_end_idx]
-            
-            chunk_start_time = start_time + (chunk_start_idx / samprate)
-            chunk_end_time = start_time + (chunk_end_idx / samprate)
-            
-            # Downsample this chunk
-            downsampled_chunk = downsample_waveform(chunk_waveform, downsample_factor)
-            
-            pga = float(np.max(np.abs(downsampled_chunk))) if len(downsampled_chunk) > 0 else 0
-            
-            # Group by time window key
-            time_key = int(chunk_start_time / TIME_WINDOW)
-            if time_key not in packet_map:
-                packet_map[time_key] = {}
-                
-            packet_map[time_key][wave_id] = {
-                "waveform": downsampled_chunk.tolist(),
-                "pga": pga,
-                "startt": chunk_start_time,
-                "endt": chunk_end_time,
-                "samprate": samprate,
-                "effective_samprate": samprate / downsample_factor,
-                "original_length": len(chunk_waveform),
-                "downsampled_length": len(downsampled_chunk),
-                "downsample_factor": downsample_factor
-            }
-            
-    # Convert map to list of packets
-    all_packets = []
-    for time_key in sorted(packet_map.keys()):
-        all_packets.append(packet_map[time_key])
+        downsampled = downsample_waveform(waveform, downsample_factor)
         
-    logger.info(f"get_historical_waves_bulk: Processed {len(wave_ids)} stations, sliced into {len(all_packets)} packets")
-    return all_packets
+        wave_batch[wave_id] = {
+            "waveform": downsampled,
+            "pga": pga,
+            "startt": start_time,
+            "endt": start_time + total_samples / samprate,
+            "samprate": samprate,
+            "effective_samprate": samprate / downsample_factor,
+            "original_length": total_samples,
+            "downsampled_length": len(downsampled),
+            "downsample_factor": downsample_factor
+        }
+        
+    logger.info(f"get_historical_waves_bulk: Processed {len(wave_batch)} stations")
+    return wave_batch
 
 
 async def get_historical_picks(redis_client, start_time, end_time):
@@ -496,9 +668,8 @@ async def get_historical_picks(redis_client, start_time, end_time):
         raw_data = msg_data.get(b'data')
         if raw_data:
             try:
-                # Decode and parse pick data
-                text_data = raw_data.decode('utf-8')
-                json_data = json.loads(text_data)
+                # Parse pick data straight from the raw bytes (cached per payload)
+                json_data = parse_pick_content(raw_data)
                 if isinstance(json_data, dict):
                     # Create unique key from station, channel, and pick time
                     station = json_data.get('station', '')
@@ -535,23 +706,30 @@ async def get_historical_picks(redis_client, start_time, end_time):
 
 async def redis_wave_reader():
     """
-    持續從 Redis 讀取所有 'wave:*' stream，批次處理後推送給 WebSocket 管理器。
+    持續從 Redis 讀取所有 'wave:*' stream，交給 wave_batch_processor 批次處理後推送給 WebSocket 管理器。
     動態掃描新的 streams。
     """
     logger.info("Starting Redis wave reader...")
-    redis_client = redis.Redis(**REDIS_CONFIG, decode_responses=False)
+    redis_client = redis.Redis(**READER_REDIS_CONFIG)
+    
+    # XREAD 結果經由佇列交給處理 task，處理與推送期間仍持續讀取 Redis；
+    # 佇列滿了（處理跟不上）時讀取會暫停等待
+    responses = asyncio.Queue(maxsize=WAVE_RESPONSE_QUEUE_SIZE)
+    processor = asyncio.create_task(wave_batch_processor(responses))
+    background_tasks.add(processor)
+    processor.add_done_callback(background_tasks.discard)
     
     stream_ids = {}
-    last_scan_time = 0
-    scan_interval = 5  # Rescan every 5 seconds for new streams
+    last_scan_time = float("-inf")  # scan immediately on start
+    scan_interval = 1  # Re-list streams every second (one SMEMBERS) to pick up new stations
 
     while True:
         try:
             # Periodically scan for new streams
-            current_time = time.time()
+            current_time = time.monotonic()
             if current_time - last_scan_time > scan_interval:
-                # Scan only Z-channel streams using wildcard pattern (HLZ, ENZ, BHZ, etc.)
-                stream_keys_bytes = [key async for key in redis_client.scan_iter("wave:*:*Z")]
+                # Only Z-channel streams (HLZ, ENZ, BHZ, etc.)
+                stream_keys_bytes = await get_z_stream_keys(redis_client)
                 
                 # Add new streams
                 new_streams = 0
@@ -580,19 +758,34 @@ async def redis_wave_reader():
             if not response:
                 continue
 
+            for stream_key, messages in response:
+                stream_ids[stream_key] = messages[-1][0]
+            
+            await responses.put(response)
+
+        except Exception as e:
+            logger.error(f"Error in redis_wave_reader: {e}")
+            await asyncio.sleep(0.1)
+
+
+async def wave_batch_processor(responses):
+    """
+    從佇列取出 redis_wave_reader 讀到的 XREAD 結果，批次濾波後推送給 WebSocket 管理器。
+    """
+    while True:
+        response = await responses.get()
+        # 上一批處理與推送期間累積的結果合併成同一批
+        while not responses.empty():
+            response = response + responses.get_nowait()
+        try:
             start_time = time.time()
             processed_count = 0
             
-            # Collect waveforms for batch processing
-            batch_waveforms = []  # List of (wave_id, waveform_array, pga_compute_needed)
-            wave_metadata = []  # List of metadata dicts
-            
+            # Group each wave_id's packets: several XREAD replies (and COUNT 100
+            # per stream) routinely carry consecutive packets of one stream
+            packets_by_wave = {}  # wave_id -> [(startt, endt, samprate, raw int32 bytes, constant)]
             for stream_key, messages in response:
-                last_id = messages[-1][0]
-                stream_ids[stream_key] = last_id
-
-                stream_key_str = stream_key.decode('utf-8')
-                _, station, channel = stream_key_str.split(":")
+                constant = get_stream_constant(stream_key)
                 
                 # No need to filter Z channels here - already filtered at scan time with wave:*:*Z pattern
 
@@ -601,76 +794,90 @@ async def redis_wave_reader():
                     if not waveform_bytes:
                         continue
                     
-                    waveform_raw = np.frombuffer(waveform_bytes, dtype=np.int32)
-                    
-                    wave_meta = {'station': station, 'channel': channel, 'network': msg_data.get(b'network', b'TW').decode('utf-8')}
-                    wave_meta = convert_to_tsmip_legacy_naming(wave_meta)
-                    constant = get_wave_constant(wave_meta)
-                    waveform_scaled = waveform_raw * constant
-                    
-                    network = msg_data.get(b'network', b'SM').decode('utf-8')
-                    location = msg_data.get(b'location', b'01').decode('utf-8')
-                    wave_id = f"{network}.{station}.{location}.{channel}"
-                    
-                    # Collect for batch processing
-                    batch_waveforms.append(waveform_scaled)
-                    wave_metadata.append({
-                        'wave_id': wave_id,
-                        'startt': float(msg_data.get(b'startt', b'0')),
-                        'endt': float(msg_data.get(b'endt', b'0')),
-                        'samprate': int(float(msg_data.get(b'samprate', b'100'))),
-                    })
+                    packets_by_wave.setdefault(get_wave_id(stream_key, msg_data), []).append((
+                        float(msg_data.get(b'startt', b'0')),
+                        float(msg_data.get(b'endt', b'0')),
+                        int(float(msg_data.get(b'samprate', b'100'))),
+                        waveform_bytes,
+                        constant,
+                    ))
                     processed_count += 1
 
-            # Batch process all waveforms at once
-            if not batch_waveforms:
+            if not packets_by_wave:
                 continue
 
-            wave_batch = {}
+            # Join contiguous packets of a wave_id (in startt order) into one run
+            # so none is overwritten in the wave_id-keyed frame; a run that
+            # starts after a gap goes into the next frame (run_index)
+            # Parallel lists (one entry per run) instead of a metadata dict per run
+            batch_counts = []  # raw int32 bytes, scaled straight into the filter's batch matrix
+            batch_constants = []
+            batch_wave_ids = []
+            batch_run_indices = []
+            batch_startts = []
+            batch_endts = []
+            batch_samprates = []
+            for wave_id, packets in packets_by_wave.items():
+                packets.sort(key=itemgetter(0))
+                run_index = -1
+                run_chunks = None
+                for startt, endt, samprate, waveform_bytes, constant in packets:
+                    if (run_chunks is not None and samprate == batch_samprates[-1]
+                            and abs(startt - batch_endts[-1]) <= 2.0 / samprate):
+                        run_chunks.append(waveform_bytes)
+                        batch_endts[-1] = endt
+                        continue
+                    if run_chunks is not None:
+                        batch_counts.append(b"".join(run_chunks))
+                    run_index += 1
+                    run_chunks = [waveform_bytes]
+                    batch_constants.append(constant)
+                    batch_wave_ids.append(wave_id)
+                    batch_run_indices.append(run_index)
+                    batch_startts.append(startt)
+                    batch_endts.append(endt)
+                    batch_samprates.append(samprate)
+                batch_counts.append(b"".join(run_chunks))
+
+            wave_batches = [{} for _ in range(max(batch_run_indices) + 1)]
             try:
                 # Process all waveforms in batch
-                processed_waveforms = batch_signal_processing(batch_waveforms)
-                
-                # Build wave_batch
-                for i, waveform_processed in enumerate(processed_waveforms):
-                    if waveform_processed is None or len(waveform_processed) == 0:
-                        continue
-                    
-                    meta = wave_metadata[i]
-                    pga = float(np.max(np.abs(waveform_processed)))
-                    
-                    wave_batch[meta['wave_id']] = {
-                        "waveform": waveform_processed.tolist(),
-                        "pga": pga,
-                        "startt": meta['startt'],
-                        "endt": meta['endt'],
-                        "samprate": meta['samprate'],
-                    }
+                # Filter in the worker thread so the event loop keeps serving WebSockets
+                processed_waveforms, pgas = await asyncio.get_running_loop().run_in_executor(
+                    signal_executor, partial(batch_counts_processing, with_pga=True), batch_counts, batch_constants
+                )
             except Exception as e:
                 logger.error(f"Batch processing error: {e}")
-                # Fallback to individual processing if batch fails
-                for i, waveform_scaled in enumerate(batch_waveforms):
-                    try:
-                        waveform_processed = signal_processing(waveform_scaled)
-                        if waveform_processed is None:
-                            continue
-                        
-                        meta = wave_metadata[i]
-                        pga = float(np.max(np.abs(waveform_processed)))
-                        
-                        wave_batch[meta['wave_id']] = {
-                            "waveform": waveform_processed.tolist(),
-                            "pga": pga,
-                            "startt": meta['startt'],
-                            "endt": meta['endt'],
-                            "samprate": meta['samprate'],
-                        }
-                    except Exception as e2:
-                        logger.error(f"Individual processing error for {meta['wave_id']}: {e2}")
+                # Fallback to individual processing if batch fails,
+                # still on the signal worker thread (not on the event loop)
+                try:
+                    processed_waveforms, pgas = await asyncio.get_running_loop().run_in_executor(
+                        signal_executor, individual_counts_processing, batch_counts, batch_constants
+                    )
+                except Exception as e2:
+                    logger.error(f"Individual processing error: {e2}")
+                    continue
+
+            # Build wave_batches
+            for wave_id, run_index, waveform_processed, pga, startt, endt, samprate in zip(
+                batch_wave_ids, batch_run_indices, processed_waveforms, pgas, batch_startts, batch_endts, batch_samprates
+            ):
+                if waveform_processed is None or len(waveform_processed) == 0:
+                    continue
+                
+                wave_batches[run_index][wave_id] = {
+                    "waveform": waveform_processed,
+                    "pga": float(pga),
+                    "startt": startt,
+                    "endt": endt,
+                    "samprate": samprate,
+                }
 
             processing_time = time.time() - start_time
             
-            if wave_batch:
+            for wave_batch in wave_batches:
+                if not wave_batch:
+                    continue
                 timestamp = int(time.time() * 1000)
                 wave_packet = {
                     "waveid": f"batch_{timestamp}",
@@ -681,11 +888,11 @@ async def redis_wave_reader():
                 logger.info(f"Processed {processed_count} Z-channel waves in {processing_time:.3f}s, sending {len(wave_batch)} to clients")
                 
                 await socket_manager.send_wave_packet(wave_packet)
+            if any(wave_batches):
                 await asyncio.sleep(0.33)
 
         except Exception as e:
-            logger.error(f"Error in redis_wave_reader: {e}")
-            await asyncio.sleep(0.1)
+            logger.error(f"Error in wave_batch_processor: {e}")
 
 
 async def redis_pick_reader():
@@ -693,7 +900,7 @@ async def redis_pick_reader():
     持續從 Redis 讀取 'pick' stream，批次推送給 WebSocket 管理器。
     """
     logger.info("Starting Redis pick reader (batch mode)...")
-    redis_client = redis.Redis(**REDIS_CONFIG, decode_responses=False)
+    redis_client = redis.Redis(**READER_REDIS_CONFIG)
     stream_key = "pick"
     last_id = '0-0'
 
@@ -715,36 +922,12 @@ async def redis_pick_reader():
                     if not raw_data:
                         continue
 
-                    try:
-                        # Try to decode as utf-8 text
-                        text_data = raw_data.decode('utf-8')
-                    except:
-                        text_data = str(raw_data)
-                    
-                    # Try to parse as JSON (if reader sent a JSON string)
-                    try:
-                        json_data = json.loads(text_data)
-                        if isinstance(json_data, dict):
-                            # It's a parsed pick object
-                            packet = {
-                                "type": "pick",
-                                "content": json_data,
-                                "timestamp": time.time()
-                            }
-                        else:
-                            # It's just a string (or other JSON type)
-                            packet = {
-                                "type": "pick",
-                                "content": text_data,
-                                "timestamp": time.time()
-                            }
-                    except json.JSONDecodeError:
-                        # Not JSON, treat as raw text
-                        packet = {
-                            "type": "pick",
-                            "content": text_data,
-                            "timestamp": time.time()
-                        }
+                    # Parsed pick object if the reader sent a JSON object, raw text otherwise
+                    packet = {
+                        "type": "pick",
+                        "content": parse_pick_content(raw_data),
+                        "timestamp": time.time()
+                    }
                     
                     pick_batch.append(packet)
             
@@ -771,7 +954,7 @@ async def redis_eew_reader():
     持續從 Redis 讀取 'eew' stream，推送給 WebSocket 管理器。
     """
     logger.info("Starting Redis eew reader...")
-    redis_client = redis.Redis(**REDIS_CONFIG, decode_responses=False)
+    redis_client = redis.Redis(**READER_REDIS_CONFIG)
     stream_key = "eew"
     last_id = '$'
 
@@ -810,7 +993,12 @@ site_info_file = "/workspace/station/site_info.csv"
 constant_dict = {}
 try:
     logger.info(f"Loading {site_info_file}...")
-    site_info = pd.read_csv(site_info_file)
+    # Only the lookup columns; station/channel codes are always looked up as strings
+    site_info = pd.read_csv(
+        site_info_file,
+        usecols=["Station", "Channel", "Constant"],
+        dtype={"Station": str, "Channel": str},
+    )
     constant_dict = site_info.set_index(["Station", "Channel"])["Constant"].to_dict()
     logger.info(f"{site_info_file} loaded")
 
@@ -818,9 +1006,13 @@ except FileNotFoundError:
     logger.warning(f"{site_info_file} not found")
 
 
+ID_CODE = {"N": "network", "S": "station", "L": "location", "C": "channel"}
+
+
 def join_id_from_dict(data, order="NSLC"):
-    code = {"N": "network", "S": "station", "L": "location", "C": "channel"}
-    data_id = ".".join(data[code[letter]] for letter in order)
+    if order == "NSLC":
+        return f'{data["network"]}.{data["station"]}.{data["location"]}.{data["channel"]}'
+    data_id = ".".join(data[ID_CODE[letter]] for letter in order)
     return data_id
 
 
@@ -834,6 +1026,61 @@ def convert_to_tsmip_legacy_naming(wave):
 # Cache for missing stations to avoid log flooding
 missing_stations_cache = set()
 
+# stream key (b'wave:STA:CHA') -> constant；常數只跟測站與頻道有關，每個 stream 只查一次
+stream_constant_cache = {}
+
+def get_stream_constant(stream_key):
+    """依 Redis stream key 取得 count 轉 cm/s^2 的常數（快取，不需逐筆訊息查表）"""
+    constant = stream_constant_cache.get(stream_key)
+    if constant is None:
+        key_str = stream_key.decode("utf-8") if isinstance(stream_key, bytes) else stream_key
+        _, station, channel = key_str.split(":")
+        constant = get_wave_constant({"station": station, "channel": channel})
+        stream_constant_cache[stream_key] = constant
+    return constant
+
+# (stream key, network, location) -> wave_id，例如 'SM.A024.01.HLZ'
+wave_id_cache = {}
+
+def get_wave_id(stream_key, msg_data):
+    """依 stream key 與訊息中的 network/location 組出 wave_id（快取，不需逐筆 decode 與格式化）"""
+    network = msg_data.get(b'network', b'SM')
+    location = msg_data.get(b'location', b'01')
+    cache_key = (stream_key, network, location)
+    wave_id = wave_id_cache.get(cache_key)
+    if wave_id is None:
+        key_str = stream_key.decode("utf-8") if isinstance(stream_key, bytes) else stream_key
+        _, station, channel = key_str.split(":")
+        wave_id = f"{network.decode('utf-8')}.{station}.{location.decode('utf-8')}.{channel}"
+        wave_id_cache[cache_key] = wave_id
+    return wave_id
+
+@lru_cache(maxsize=1024)
+def parse_pick_content(raw_data):
+    """
+    解析 pick 的 data 欄位：JSON 物件回傳 dict，其他（非 JSON 或非物件）回傳原始文字。
+    以 raw bytes 快取，重播或重送的同一筆 pick 不再重複解析；回傳的 dict 為共用物件，不可修改
+    """
+    # 只有 JSON 物件會以 dict 回傳，開頭不是 '{' 的內容不必嘗試解析
+    if raw_data.lstrip()[:1] == b"{":
+        try:
+            json_data = json_loads(raw_data)
+            if isinstance(json_data, dict):
+                return json_data
+        except json.JSONDecodeError:
+            pass
+    try:
+        return raw_data.decode('utf-8')
+    except UnicodeDecodeError:
+        return str(raw_data)
+
+def counts_to_float32(waveform_bytes, constant):
+    """
+    將 Redis 中的 int32 count 乘上常數，直接輸出 float32（不經 float64 中間陣列）
+    前端以 float32 顯示，後續濾波也以 float32 陣列存放，記憶體流量減半
+    """
+    return np.multiply(np.frombuffer(waveform_bytes, dtype=np.int32), constant, dtype=np.float32)
+
 def downsample_waveform(waveform, factor):
     """
     簡單降採樣：每 factor 個點取一個
@@ -849,6 +1096,49 @@ def downsample_waveform(waveform, factor):
         return waveform
     return waveform[::factor]
 
+def pack_binary_frame(header, waveforms):
+    """
+    將 JSON header 與 float32 波形打包成單一 WebSocket 二進位 frame
+
+    格式：[uint32 LE header 長度][UTF-8 JSON header，補空白至 4 bytes 對齊][float32 LE 樣本...]
+    header 內每筆波形的 "waveform" 為 [offset, length]（以樣本數計，相對於樣本區起點），
+    前端以 Float32Array 直接取 view，不需逐點解析。
+
+    Args:
+        header: 可 JSON 序列化的 dict
+        waveforms: numpy array 列表，依 offset 順序串接
+
+    Returns:
+        bytes
+    """
+    header_bytes = json_dumps(header)
+    header_bytes += b" " * (-len(header_bytes) % 4)  # 4 + header 長度需為 4 的倍數
+    # 所有波形（含降採樣後的 stride view）一次複製成連續的 float32 樣本區
+    samples = np.concatenate(waveforms, dtype="<f4") if waveforms else np.empty(0, dtype="<f4")
+    return b"".join((struct.pack("<I", len(header_bytes)), header_bytes, samples.data))
+
+def pack_wave_batch_frame(event, wave_packet):
+    """
+    將 wave_packet["data"] 中每筆波形（numpy array）換成 [offset, length]，
+    以 pack_binary_frame 打包成二進位 frame
+
+    Args:
+        event: 事件名稱，例如 "historical_data"
+        wave_packet: {"waveid", "timestamp", "data": {wave_id: {"waveform": ndarray, ...}}}
+
+    Returns:
+        bytes
+    """
+    waves = {}
+    waveforms = []
+    offset = 0
+    for wave_id, wave_data in wave_packet["data"].items():
+        waveform = wave_data["waveform"]
+        waves[wave_id] = {**wave_data, "waveform": [offset, len(waveform)]}
+        waveforms.append(waveform)
+        offset += len(waveform)
+    return pack_binary_frame({"event": event, "data": {**wave_packet, "data": waves}}, waveforms)
+
 def calculate_downsample_factor(samprate, resolution_width):
     """
     計算降採樣因子
@@ -866,7 +1156,7 @@ def calculate_downsample_factor(samprate, resolution_width):
     target_points = resolution_width * POINTS_PER_PIXEL
     # 計算降採樣因子
     factor = int(total_points / target_points)
-    return max(1, factor)  # 至少為 1（不降採樣）
+    return max(MIN_DOWNSAMPLE_FACTOR, factor)  # 至少為 MIN_DOWNSAMPLE_FACTOR（預設 1，不降採樣）
 
 def get_wave_constant(wave):
     # count to cm/s^2
@@ -874,9 +1164,10 @@ def get_wave_constant(wave):
     channel = wave["channel"]
     key = (station, channel)
     
-    # Fast path: direct lookup
-    if key in constant_dict:
-        return constant_dict[key]
+    # Fast path: single lookup
+    constant = constant_dict.get(key)
+    if constant is not None:
+        return constant
     
     # Slow path: handle missing key
     if key not in missing_stations_cache:
@@ -887,58 +1178,246 @@ def get_wave_constant(wave):
         
     return 3.2e-6
 
-def batch_signal_processing(waveforms):
+if njit is not None:
+    @njit(cache=True, parallel=True, nogil=True)
+    def _detrend_sosfilt_rows(sos, x, lengths):
+        """
+        Demean + cascaded biquad filter (direct form II transposed, as
+        scipy.sosfilt) fused into one pass per row. Row r holds a trace of
+        lengths[r] samples (zero padding after it is left as 0 in the
+        output); rows are processed in parallel. The mean and filter state
+        are accumulated in float64 whatever the dtype of x; out has x's dtype.
+        """
+        n_rows, n_samples = x.shape
+        n_sections = sos.shape[0]
+        out = np.zeros_like(x)
+        for r in prange(n_rows):
+            n = lengths[r]
+            if n == 0:
+                continue
+            mean = 0.0
+            for t in range(n):
+                mean += x[r, t]
+            mean /= n
+            zi = np.zeros((n_sections, 2))
+            for t in range(n):
+                y = x[r, t] - mean
+                for s in range(n_sections):
+                    y_out = sos[s, 0] * y + zi[s, 0]
+                    zi[s, 0] = sos[s, 1] * y - sos[s, 4] * y_out + zi[s, 1]
+                    zi[s, 1] = sos[s, 2] * y - sos[s, 5] * y_out
+                    y = y_out
+                out[r, t] = y
+        return out
+    @njit(cache=True, parallel=True, nogil=True)
+    def _rows_abs_max(x, lengths):
+        """max(|x[r, :lengths[r]]|) of every row, rows in parallel"""
+        out = np.zeros(x.shape[0])
+        for r in prange(x.shape[0]):
+            m = 0.0
+            for t in range(lengths[r]):
+                a = x[r, t] if x[r, t] >= 0 else -x[r, t]
+                if a > m:
+                    m = a
+            out[r] = m
+        return out
+    @njit(cache=True, nogil=True)
+    def _abs_max(x):
+        """max(|x|) in one pass, without materializing np.abs(x)"""
+        m = 0.0
+        for v in x:
+            a = v if v >= 0 else -v
+            if a > m:
+                m = a
+        return m
+    @njit(cache=True, nogil=True)
+    def _taper_pga(x, taper_len, factor):
+        """
+        Linear 0->1 taper over x[:taper_len] in place (as np.linspace), then
+        max(|x|) over the decimated samples x[::factor].
+        """
+        step = 1.0 / (taper_len - 1) if taper_len > 1 else 0.0
+        for t in range(taper_len):
+            x[t] *= t * step
+        m = 0.0
+        for t in range(0, len(x), factor):
+            a = x[t] if x[t] >= 0 else -x[t]
+            if a > m:
+                m = a
+        return m
+else:
+    _detrend_sosfilt_rows = None
+    _rows_abs_max = None
+    _abs_max = None
+    _taper_pga = None
+
+def gpu_detrend_sosfilt_rows(sos, x, lengths):
+    """
+    batch_signal_processing 的 GPU 版本（cupy）：整批搬到 GPU，
+    逐列扣除實際樣本的平均值後以 cupyx.scipy.signal.sosfilt 濾波，再搬回主記憶體。
+    沒有可用的 GPU（CUDA 錯誤）時停用 GPU 路徑並回傳 None，由呼叫端改用 CPU 濾波
+    """
+    global cupy_sosfilt
+    try:
+        x_gpu = cp.asarray(x)
+        means = x_gpu.sum(axis=1) / cp.maximum(cp.asarray(lengths), 1)
+        x_gpu -= means[:, None].astype(x_gpu.dtype)
+        return cp.asnumpy(cupy_sosfilt(cp.asarray(sos), x_gpu, axis=1))
+    except Exception as e:
+        logger.warning(f"GPU sosfilt unavailable, falling back to CPU: {e}")
+        cupy_sosfilt = None
+        return None
+
+def abs_max(waveform):
+    """PGA：波形絕對值最大值，不建立 np.abs 的中間陣列"""
+    if _abs_max is not None:
+        return float(_abs_max(waveform))
+    return float(max(waveform.max(), -waveform.min()))
+
+def rows_abs_max(x, lengths):
+    """整批 PGA：每列只看實際的 lengths[r] 個樣本（padding 之後的濾波尾巴不算）"""
+    if _rows_abs_max is not None:
+        return _rows_abs_max(x, lengths)
+    valid = np.arange(x.shape[1]) < lengths[:, None]
+    return np.maximum(
+        -x.min(axis=1, where=valid, initial=0), x.max(axis=1, where=valid, initial=0)
+    ).astype(np.float64)
+
+def taper_and_pga(waveform, taper_len, factor):
+    """
+    歷史波形：前 taper_len 點做 0→1 線性 taper（就地修改），
+    並回傳降採樣後（每 factor 點取一）整段波形的 PGA
+    """
+    if _taper_pga is not None:
+        return float(_taper_pga(waveform, taper_len, factor))
+    waveform[:taper_len] *= np.linspace(0, 1, taper_len)
+    return abs_max(waveform[::factor])
+
+def batch_signal_processing(waveforms, with_pga=False):
     """
     Batch process multiple waveforms at once for 10x+ speedup.
     Uses numpy padding and vectorized operations.
+    With with_pga=True, returns (waveforms, pgas) where pgas holds each
+    filtered waveform's PGA, reduced over the whole batch in one pass.
     """
     if not waveforms:
-        return []
+        return ([], []) if with_pga else []
     
     try:
-        # Find max length
-        max_len = max(len(w) for w in waveforms)
-        
-        # Pad all waveforms to same length and stack into 2D array
-        padded_waveforms = []
-        original_lengths = []
-        
-        for waveform in waveforms:
-            original_lengths.append(len(waveform))
-            if len(waveform) < max_len:
-                # Pad with zeros
-                padded = np.pad(waveform, (0, max_len - len(waveform)), mode='constant')
-                padded_waveforms.append(padded)
-            else:
-                padded_waveforms.append(waveform)
-        
-        # Stack into 2D array (n_waveforms, max_len)
-        stacked = np.array(padded_waveforms)
-        
-        # Batch detrend (subtract mean for each row)
-        detrended = stacked - np.mean(stacked, axis=1, keepdims=True)
-        
-        # Batch lowpass filter
+        lengths = np.fromiter(map(len, waveforms), dtype=np.int64, count=len(waveforms))
+        if lengths.min() == lengths.max():
+            # Same length: stack directly, nothing to pad
+            stacked = np.stack(waveforms, dtype=np.float32)
+        else:
+            # Allocate the zero-padded (n_waveforms, max_len) array once and
+            # copy each waveform into its row
+            stacked = np.zeros((len(waveforms), lengths.max()), dtype=np.float32)
+            for i, waveform in enumerate(waveforms):
+                stacked[i, :lengths[i]] = waveform
+    except Exception as e:
+        logger.error(f"batch_signal_processing error: {e}")
+        # Fallback to individual processing
+        result = [signal_processing(w) for w in waveforms]
+        if with_pga:
+            return result, [abs_max(w) if w is not None and len(w) else 0.0 for w in result]
+        return result
+
+    return filter_padded_rows(stacked, lengths, with_pga)
+
+
+def batch_counts_processing(counts_bytes, constants, with_pga=False):
+    """
+    即時波形的批次濾波：Redis 的 int32 counts 乘上各自的常數後，
+    直接寫入同一個預先配置的 float32 padded 矩陣，不另建每筆的 float32 陣列
+    """
+    if not counts_bytes:
+        return ([], []) if with_pga else []
+
+    n = len(counts_bytes)
+    lengths = np.fromiter((len(b) // 4 for b in counts_bytes), dtype=np.int64, count=n)
+    if lengths.min() == lengths.max():
+        # 常見情況：每筆封包樣本數相同，整批 bytes 直接視為 (n, L) int32 矩陣，一次乘上各列常數
+        counts = np.frombuffer(b"".join(counts_bytes), dtype=np.int32).reshape(n, lengths[0])
+        stacked = np.multiply(counts, np.array(constants, dtype=np.float32)[:, None], dtype=np.float32)
+    else:
+        stacked = np.zeros((n, lengths.max()), dtype=np.float32)
+        for i, (b, constant) in enumerate(zip(counts_bytes, constants)):
+            np.multiply(np.frombuffer(b, dtype=np.int32), constant, out=stacked[i, :lengths[i]], dtype=np.float32)
+    return filter_padded_rows(stacked, lengths, with_pga)
+
+
+def individual_counts_processing(counts_bytes, constants):
+    """
+    batch_counts_processing 失敗時的逐筆處理：每筆各自換算、濾波並計算 PGA，
+    失敗的那筆回傳 (None, 0.0)，不影響其他筆。需在 signal_executor 執行
+    """
+    result = []
+    pgas = []
+    for waveform_bytes, constant in zip(counts_bytes, constants):
+        try:
+            waveform = signal_processing(counts_to_float32(waveform_bytes, constant))
+        except Exception as e:
+            logger.error(f"Individual processing error: {e}")
+            waveform = None
+        result.append(waveform)
+        pgas.append(abs_max(waveform) if waveform is not None and len(waveform) else 0.0)
+    return result, pgas
+
+
+def filter_padded_rows(stacked, lengths, with_pga=False):
+    """
+    Demean + lowpass each row of a zero-padded float32 batch (row i holds
+    lengths[i] real samples) and return the unpadded rows, plus their PGAs
+    when with_pga=True. stacked may be demeaned in place.
+    """
+    try:
         sos = lowpass_sos(freq=10, df=100, corners=4)
-        filtered = sosfilt(sos, detrended, axis=1)
+
+        filtered = None
+        if cupy_sosfilt is not None and stacked.size >= GPU_MIN_SAMPLES:
+            # Large batches (historical replays) go to the GPU
+            filtered = gpu_detrend_sosfilt_rows(sos, stacked, lengths)
+
+        if filtered is None and _detrend_sosfilt_rows is not None:
+            # Demean + lowpass fused in one compiled pass per row
+            filtered = _detrend_sosfilt_rows(sos, stacked, lengths)
+        elif filtered is None:
+            # Batch detrend (subtract each row's mean over its real samples,
+            # not the zero padding)
+            means = stacked.sum(axis=1) / np.maximum(lengths, 1)
+            np.subtract(stacked, means[:, None], out=stacked, casting="same_kind")
+
+            # Batch lowpass filter
+            filtered = sosfilt(sos, stacked, axis=1)
         
         # Unpad and return individual waveforms
         result = []
-        for i, orig_len in enumerate(original_lengths):
+        for i, orig_len in enumerate(lengths):
             result.append(filtered[i, :orig_len])
         
+        if with_pga:
+            return result, rows_abs_max(filtered, lengths)
         return result
         
     except Exception as e:
-        logger.error(f"batch_signal_processing error: {e}")
+        logger.error(f"filter_padded_rows error: {e}")
         # Fallback to individual processing
-        return [signal_processing(w) for w in waveforms]
+        result = [signal_processing(stacked[i, :n]) for i, n in enumerate(lengths)]
+        if with_pga:
+            return result, [abs_max(w) if w is not None and len(w) else 0.0 for w in result]
+        return result
 
 
 def signal_processing(waveform):
     try:
+        if _detrend_sosfilt_rows is not None:
+            # Same compiled demean + lowpass kernel as the batch path, on one row
+            sos = lowpass_sos(freq=10, df=100, corners=4)
+            lengths = np.array([len(waveform)], dtype=np.int64)
+            return _detrend_sosfilt_rows(sos, np.ascontiguousarray(waveform)[None, :], lengths)[0]
+
         # demean and lowpass filter
-        data = detrend(waveform, type="constant")
+        data = waveform - waveform.mean()  # same as detrend(type="constant"), without scipy's overhead
         data = lowpass(data, freq=10)
 
         return data
@@ -952,21 +1431,16 @@ def lowpass(data, freq=10, df=100, corners=4):
     Modified form ObsPy Signal Processing
     https://docs.obspy.org/_modules/obspy/signal/filter.html#lowpass
     """
-    fe = 0.5 * df
-    f = freq / fe
-
-    if f > 1:
-        f = 1.0
-    z, p, k = iirfilter(corners, f, btype="lowpass", ftype="butter", output="zpk")
-    sos = zpk2sos(z, p, k)
-
-    return sosfilt(sos, data)
+    return sosfilt(lowpass_sos(freq, df, corners), data)
 
 
+@lru_cache(maxsize=None)
 def lowpass_sos(freq=10, df=100, corners=4):
     """
     Return SOS (second-order sections) for lowpass filter.
     Used for batch processing.
+    Cached per (freq, df, corners): the filter design is far costlier than
+    filtering a short packet. The returned array is shared; do not modify it.
     """
     fe = 0.5 * df
     f = freq / fe
@@ -977,8 +1451,24 @@ def lowpass_sos(freq=10, df=100, corners=4):
     sos = iirfilter(corners, f, btype="lowpass", ftype="butter", output="sos")
     return sos
 
+
+def warmup_signal_kernels():
+    """
+    以一段假波形先跑過訊號處理，讓 numba 在第一筆 Redis 資料進來前完成編譯
+    （或載入快取），避免第一批即時波形與第一次歷史查詢被 JIT 延遲卡住。
+    假資料的型別與實際呼叫相同（float32 矩陣與其列），才會用到同一份編譯結果
+    """
+    start = time.time()
+    rows, _ = batch_counts_processing([np.zeros(100, dtype=np.int32).tobytes()], [1.0], with_pga=True)
+    taper_and_pga(rows[0], 10, 2)
+    abs_max(rows[0])
+    logger.info(f"Signal kernels ready in {time.time() - start:.2f}s")
+
 @app.on_event("startup")
 async def startup_event():
+    if not HIREDIS_AVAILABLE:
+        logger.warning("hiredis 未安裝，redis-py 改用純 Python 的 RESP 解析器 (pip install 'redis[hiredis]')")
+    await asyncio.get_running_loop().run_in_executor(signal_executor, warmup_signal_kernels)
     # 在 FastAPI 啟動時，建立背景任務
     for coro in [redis_wave_reader(), redis_pick_reader(), redis_eew_reader()]:
         task = asyncio.create_task(coro)
@@ -988,12 +1478,43 @@ async def startup_event():
 @app.on_event("shutdown")
 async def shutdown_event():
     logger.info("Shutting down background tasks...")
-    for task in background_tasks:
+    # 先取快照再清空，取消後的 done callback 不會再動到正在走訪的 set
+    tasks = list(background_tasks)
+    background_tasks.clear()
+    for task in tasks:
         task.cancel()
-    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await asyncio.gather(*tasks, return_exceptions=True)
+    signal_executor.shutdown(wait=False, cancel_futures=True)
+    await redis_pool.disconnect()
     logger.info("Background tasks shut down.")
 
 
+try:
+    from websockets.extensions.permessage_deflate import ServerPerMessageDeflateFactory
+    try:
+        from uvicorn.protocols.websockets.websockets_sansio_impl import WebSocketsSansIOProtocol as _WebSocketProtocol
+    except ImportError:  # 舊版 uvicorn 只有 websockets legacy 實作
+        from uvicorn.protocols.websockets.websockets_impl import WebSocketProtocol as _WebSocketProtocol
+
+    class DeflateWebSocketProtocol(_WebSocketProtocol):
+        """uvicorn 的 websockets 協定，permessage-deflate 改用 WS_DEFLATE_LEVEL 壓縮等級"""
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            if self.config.ws_per_message_deflate:
+                # zlib 預設 level 6；level 1 壓縮率略低但 CPU 少很多。4KB 視窗降低每連線記憶體
+                # sansio 實作的協商在 self.conn，legacy 實作在 protocol 本身
+                getattr(self, "conn", self).available_extensions = [
+                    ServerPerMessageDeflateFactory(
+                        server_max_window_bits=12,
+                        client_max_window_bits=12,
+                        compress_settings={"level": WS_DEFLATE_LEVEL, "memLevel": 5},
+                    )
+                ]
+except ImportError:  # 沒有 websockets 套件時使用 uvicorn 預設的 WebSocket 實作
+    DeflateWebSocketProtocol = None
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="FastAPI WebSocket server for EEW.")
     parser.add_argument("--host", type=str, default="0.0.0.0", help="Web server IP")
@@ -1001,4 +1522,10 @@ if __name__ == "__main__":
     args = parser.parse_args()
 
     logger.info(f"Starting server on {args.host}:{args.port}")
-    uvicorn.run(app, host=args.host, port=args.port)
\ No newline at end of file
+    uvicorn.run(
+        app,
+        host=args.host,
+        port=args.port,
+        ws=DeflateWebSocketProtocol or "auto",
+        ws_per_message_deflate=WS_DEFLATE,
+    )
\ No newline at end of file